@@ -0,0 +1,240 @@
+#!/usr/bin/env python2.7
+"""Benchmarks the pure-python hot loops of the console
+
+Runs each loop for a few seconds against simulated hardware and prints how many
+iterations per second it managed. To compare interpreters:
+
+  ./benchmark.py              # just the interpreter running this script
+  ./benchmark.py --compare    # every interpreter in INTERPRETERS we can find
+
+With --game[=<seconds>], plays that much game (an hour by default) on a
+simulated board and clock instead, as fast as we can, with players flipping
+switches at random; it prints the same stats the console does when it stops.
+"""
+
+from collections import deque
+from distutils.spawn import find_executable
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from spaceteam import clock, state
+from spaceteam.client import Client
+from spaceteam.executive import Executive
+from spaceteam.mcp23017 import MCP23017, MCP23017Group
+from spaceteam.peripherals import simulated_board
+from spaceteam.simulated import SimulatedI2CBus
+from spaceteam.ticker import Ticker
+
+BENCH_SEC = 3
+INTERPRETERS = ['python2.7', 'pypy']
+
+MCP_ADDRESSES = [0x20, 0x21, 0x22, 0x26, 0x27]
+
+# for --game: an hour of play, at the console's default rate, with a couple of
+# switch flips a second and the server changing integrity now and then
+GAME_SEC = 3600
+GAME_RATE_HZ = 100
+FLIPS_PER_SEC = 2
+INTEGRITY_EVERY_SEC = 10
+
+def bench(name, setup):
+  """runs the loop returned by setup() for BENCH_SEC; returns loops per second"""
+  loop = setup()
+
+  loops = 0
+  started = time.time()
+  deadline = started + BENCH_SEC
+  while time.time() < deadline:
+    for _ in xrange(100):
+      loop()
+    loops += 100
+
+  return loops / (time.time() - started)
+
+def mcp_loop():
+  """reading every expander, with inputs changing as we go"""
+  bus = SimulatedI2CBus()
+  mcps = [MCP23017(bus, address) for address in MCP_ADDRESSES]
+  for mcp in mcps:
+    mcp.reset()
+
+  counter = [0]
+  def loop():
+    counter[0] += 1
+    bus.device(0x20)[0x12] = counter[0] & 0xFF
+    for mcp in mcps:
+      mcp.communicate()
+
+  return loop
+
+def mcp_group_loop():
+  """reading every expander in one combined transaction"""
+  bus = SimulatedI2CBus()
+  mcps = [MCP23017(bus, address) for address in MCP_ADDRESSES]
+  for mcp in mcps:
+    mcp.reset()
+  group = MCP23017Group(bus, mcps)
+
+  counter = [0]
+  def loop():
+    counter[0] += 1
+    bus.device(0x20)[0x12] = counter[0] & 0xFF
+    group.communicate()
+
+  return loop
+
+def controls_loop():
+  """reading every control on a simulated board, with switches flipping"""
+  board = simulated_board()
+  inputs = state.build_inputs(board)
+  changes = deque()
+  for i in inputs:
+    i['control'].bind(i['id'], changes)
+  board.poll_only(state.used_pins(inputs))
+  board.reset_all()
+
+  counter = [0]
+  def loop():
+    counter[0] += 1
+    board.i2c.device(0x20)[0x12] = counter[0] & 0xFF
+    for group in board.expanders:
+      group.communicate()
+
+    state.poll(inputs)
+    for _ in state.changes(changes):
+      pass
+
+  return loop
+
+def client_loop():
+  """framing a state update, and parsing one back out of the buffer"""
+  client = Client('localhost')
+  def loop():
+    msg = client.encode({'message': 'set-state', 'data': {'id': 'nuke_key', 'state': 'True'}})
+    client.read_buffer += msg
+    client.pop_from_buffer()
+
+  return loop
+
+class _Peripheral(object):
+  RATE_HZ = 200
+  def communicate(self):
+    pass
+
+def executive_loop():
+  """scheduling a board's worth of peripherals"""
+  executive = Executive()
+  for _ in MCP_ADDRESSES:
+    executive.add(_Peripheral(), 'input')
+  for _ in xrange(7):
+    executive.add(_Peripheral(), 'output', rate_hz = 50)
+
+  now = [0]
+  def loop():
+    now[0] += 0.005
+    executive.run_all(now[0])
+
+  return loop
+
+BENCHMARKS = [
+    ('mcp', mcp_loop),
+    ('mcp group', mcp_group_loop),
+    ('controls', controls_loop),
+    ('client', client_loop),
+    ('executive', executive_loop),
+  ]
+
+def run_all():
+  return dict((name, bench(name, setup)) for name, setup in BENCHMARKS)
+
+def game(seconds):
+  """plays seconds of game on a simulated board and clock; returns the wall time taken"""
+  clock.install(clock.SimulatedClock())
+  rng = random.Random(0)
+
+  board = simulated_board()
+  state.load(board)
+  board.reset_all()
+  board.read_all()
+  state.announce()
+
+  # every pin some control reads, as (expander, pin bit)
+  used = sorted((mcp.address, bit) for mcp, mask in state.used_pins().items()
+      for bit in (1 << n for n in xrange(16)) if mask & bit)
+  buses = dict((mcp.address, mcp.smbus) for mcp in board.inputs if hasattr(mcp, 'smbus'))
+
+  ticker = Ticker(GAME_RATE_HZ)
+  changes = 0
+  next_integrity = INTEGRITY_EVERY_SEC
+  started = time.time()
+
+  ticker.start()
+  now = clock.CLOCK.now()
+  while now < seconds:
+    now = ticker.wait()
+
+    if rng.random() < float(FLIPS_PER_SEC) / GAME_RATE_HZ:
+      address, bit = rng.choice(used)
+      registers = buses[address].device(address)
+      # GPIOA holds the top byte of the register, GPIOB the bottom
+      if bit >> 8:
+        registers[0x12] ^= bit >> 8
+      else:
+        registers[0x13] ^= bit
+
+    if now >= next_integrity:
+      board.integrity.update(rng.randint(0, 100))
+      next_integrity += INTEGRITY_EVERY_SEC
+
+    board.read_inputs(now)
+    state.poll()
+    changes += len(list(state.changes()))
+    board.write_outputs(now)
+
+  elapsed = time.time() - started
+  print ticker
+  print board.executive
+  print board.bus_report()
+  print "%d changes reported" % changes
+  return elapsed
+
+def compare():
+  """runs ourselves under every interpreter we can find, and tabulates"""
+  results = []
+  for interpreter in INTERPRETERS:
+    path = find_executable(interpreter)
+    if not path:
+      print "skipping %s: not found" % interpreter
+      continue
+
+    output = subprocess.check_output([path, __file__, '--json'])
+    results.append((interpreter, json.loads(output)))
+
+  if not results:
+    return
+
+  print "%-12s" % "loop" + "".join("%16s" % i for i, _ in results)
+  for name, _ in BENCHMARKS:
+    print "%-12s" % name + "".join("%14.0f/s" % r[name] for _, r in results)
+
+def main(args):
+  game_args = [arg for arg in args if arg == '--game' or arg.startswith('--game=')]
+  if game_args:
+    seconds = float(game_args[0][len('--game='):]) if '=' in game_args[0] else GAME_SEC
+    elapsed = game(seconds)
+    print "%.0fs of game in %.1fs (%.0fx)" % (seconds, elapsed, seconds / elapsed)
+  elif '--compare' in args:
+    compare()
+  elif '--json' in args:
+    print json.dumps(run_all())
+  else:
+    print "%s %s" % (platform.python_implementation(), platform.python_version())
+    for name, rate in sorted(run_all().items()):
+      print "  %-12s %10.0f loops/s" % (name, rate)
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
@@ -1,11 +1,12 @@
 #!/usr/bin/env python2.7
 
 from spaceteam import peripherals
-peripherals.toggle_reset()
-peripherals.DISPLAY.reset()
+board = peripherals.real_board()
+board.toggle_reset()
+board.display.reset()
 
 import time
 
 while True:
-  peripherals.DISPLAY.message = 'Unix time is %s' % time.time()
-  peripherals.DISPLAY.communicate()
+  board.display.message = 'Unix time is %s' % time.time()
+  board.display.communicate()
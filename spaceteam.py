@@ -1,110 +1,361 @@
 #!/usr/bin/env python2.7
 
+import sys
+
+# with --profile-startup, time everything from here on, imports included
+from spaceteam.startup import PROFILE
+if '--profile-startup' in sys.argv:
+  PROFILE.start()
+
 import spaceteam
 from spaceteam import Client
 
+from spaceteam import clock
+from spaceteam.checkpoint import Checkpoint
 from spaceteam import peripherals
+from spaceteam import realtime
 from spaceteam import state
+from spaceteam.event_loop import EventLoop
+from spaceteam.export import StateExporter
+from spaceteam.gc_guard import GcGuard
+from spaceteam.ticker import Ticker, AdaptiveRate, DEFAULT_RATE_HZ, DEFAULT_IDLE_RATE_HZ
 
-import time
 import sdnotify
+import signal
 
 SERVER_IP = '10.110.0.1'
 
-def updates(prev, new):
-  diffs = {}
-  for k in prev:
-    if prev[k] != new[k]:
-      diffs[k] = new[k]
+# how often the event loop tells systemd we're alive
+WATCHDOG_INTERVAL_SEC = 1
+
+def tick_rate(args):
+  """the loop rate, which may be passed as --rate=<hz>"""
+  for arg in args:
+    if arg.startswith('--rate='):
+      return float(arg[len('--rate='):])
+
+  return DEFAULT_RATE_HZ
+
+def poll_rate(args):
+  """with --adaptive, a rate that drops to --idle-rate=<hz> when nobody's playing"""
+  if '--adaptive' not in args:
+    return None
+
+  idle_hz = DEFAULT_IDLE_RATE_HZ
+  for arg in args:
+    if arg.startswith('--idle-rate='):
+      idle_hz = float(arg[len('--idle-rate='):])
+
+  return AdaptiveRate(idle_hz = idle_hz, active_hz = tick_rate(args))
+
+def go_realtime(args):
+  """with --realtime[=<cpu>], makes the calling thread real-time (if we can)"""
+  for arg in args:
+    if arg == '--realtime':
+      return realtime.enter()
+    elif arg.startswith('--realtime='):
+      return realtime.enter(cpu = int(arg[len('--realtime='):]))
+
+def interrupt_pins(args):
+  """expander INT lines, as --interrupts=<address>:<pin>,...; addresses in hex"""
+  for arg in args:
+    if arg.startswith('--interrupts='):
+      pins = {}
+      for wire in arg[len('--interrupts='):].split(','):
+        address, pin = wire.split(':')
+        pins[int(address, 16)] = int(pin)
+      return pins
+
+  return peripherals.INTERRUPT_PINS
+
+def expander_buses(args):
+  """expanders off the main bus, as --expander-buses=<address>:<bus>,...; addresses in hex"""
+  for arg in args:
+    if arg.startswith('--expander-buses='):
+      buses = {}
+      for wire in arg[len('--expander-buses='):].split(','):
+        address, bus_id = wire.split(':')
+        buses[int(address, 16)] = int(bus_id)
+      return buses
+
+  return peripherals.EXPANDER_BUSES
+
+def make_board(args):
+  """the board we run on; with --simulated, one without any hardware"""
+  if '--simulated' in args:
+    return peripherals.simulated_board(expander_buses(args))
+
+  return peripherals.real_board(interrupt_pins(args), expander_buses(args))
+
+def start_board(args, board):
+  """gets the board going, warm if we can
+
+  After a crash we come back with a recent checkpoint; if the devices still
+  answer, we skip the reset and just restore the outputs. Simulated boards
+  aren't checkpointed, and --cold always does the full reset."""
+  if '--simulated' in args:
+    board.reset_all(background = True)
+    return
+
+  checkpoint = Checkpoint(board)
+  saved = checkpoint.load()
+  if saved is not None and '--cold' not in args and board.warm_reset(background = True):
+    print "Warm restart from %s" % checkpoint.path
+  else:
+    board.reset_all(background = True)
+
+  if saved is not None:
+    checkpoint.restore(saved)
+
+  board.add_output(checkpoint, 'disk')
+
+def start_export(args, board, ticker = None):
+  """with --export[=<path>], publishes our live state for local tools"""
+  for arg in args:
+    if arg == '--export':
+      exporter = StateExporter(board, state.INPUTS, ticker)
+    elif arg.startswith('--export='):
+      exporter = StateExporter(board, state.INPUTS, ticker, path = arg[len('--export='):])
+    else:
+      continue
 
-  return diffs
+    print "Exporting state to %s" % exporter.path
+    board.add_output(exporter, 'export')
+    return
+
+def report_change(client, id, val):
+  """tells the server about a changed control, or just prints it in local mode"""
+  if client:
+    client.update(id, val)
+  else:
+    # ids are unique; config.py checks when it compiles the controls
+    i = state.find(id)
+    if i is not None:
+      try:
+        act = i['actions'][str(val)]
+        print 'just did action %s' % act
+      except KeyError:
+        print 'changed %s to %s but no associated action' % (id, val)
+
+def apply_instruction(board, inst):
+  """applies an instruction from the server to the peripherals on board"""
+  if inst['type'] == 'display':
+    board.display.message = inst['message']
+
+  elif inst['type'] == 'progress':
+    board.red_bar.update_value(inst['message'] / 10)
+    board.orange_bar.update_value(inst['message'] / 10)
+
+  elif inst['type'] == 'status':
+    board.display.status = inst['message']
+
+  elif inst['type'] == 'integrity':
+    board.integrity.update(inst['message'])
 
 def main(args):
-  # load and initialize our peripherals
-  peripherals.reset_all()
+  if '--evented' in args:
+    return run_evented(args)
+
+  # load and initialize our peripherals; the display and sounds start in the
+  # background, so we don't wait for them before the controls work
+  with PROFILE.step("build board"):
+    board = make_board(args)
+    state.load(board)
+  start_board(args, board)
 
   # begin looping over them, reading their state
   client = None
+  ticker = Ticker(tick_rate(args))
+  start_export(args, board, ticker)
+  adaptive = poll_rate(args)
+  gc_guard = GcGuard() if '--no-gc-pauses' in args else None
   try:
     # start communication with peripherals
-    peripherals.read_all()
+    with PROFILE.step("first read"):
+      board.read_all()
 
-    # initialize an announce message
-    announce = state.announce()
+      # initialize an announce message
+      announce = state.announce()
 
     # initialize client connection
     if '--local' in args:
       print "Acting in local mode!"
     else:
-      client = Client(SERVER_IP)
-      client.start(announce)
+      with PROFILE.step("connect"):
+        client = Client(SERVER_IP)
+        client.start(announce)
+
+    # hand the peripherals over to per-bus I/O threads
+    threaded = '--threaded' in args
+    if threaded:
+      # the i2c workers are the input path, so they're the ones that get real-time
+      # with --adaptive, they slow down along with us when nobody's playing
+      board.start_workers(on_start = dict((peripherals.i2c_bus_name(bus), lambda: go_realtime(args))
+          for bus in board.i2c_buses), rate = adaptive)
+    else:
+      go_realtime(args)
 
     # initialize systemd notifications
     notifier = sdnotify.SystemdNotifier()
     notifier.notify("READY=1")
+    PROFILE.report()
+
+    # everything long-lived exists by now; keep the collector out of the loop
+    if gc_guard:
+      gc_guard.start()
 
-    # loop, generating new state each time
-    prev_state = state.generate()
+    # loop, sending any changes in state each time
+    ticker.start()
     while True:
+      # wait for the next tick; this is where we spend our idle time
+      # when polling slowly, we still wake up for any output deadlines
+      if adaptive and not threaded:
+        now = ticker.wait(until = board.executive.next_due(['output']))
+      else:
+        now = ticker.wait()
+
       # check that everything is still working
       if client and not client.running():
         raise RuntimeError("The client has stopped!")
 
+      for worker in board.workers:
+        if not worker.running():
+          raise RuntimeError("The %s has stopped!" % worker)
+
       notifier.notify("WATCHDOG=1")
 
-      # read any peripherals
-      peripherals.read_all()
+      # read any inputs which are due; with workers, take what they've read
+      if not threaded:
+        board.read_inputs(now)
+      else:
+        board.hold_inputs()
+
+      # poll quickly while people are playing, and slowly when they aren't
+      if adaptive:
+        if board.input_activity():
+          adaptive.note_activity(now)
+        ticker.set_rate(adaptive.rate(now))
 
       # first, deal with any state updates
-      new_state = state.generate()
-      for id, val in updates(prev_state, new_state).items():
-        if client:
-          client.update(id, val)
-        else:
-          i = [i for i in state.INPUTS if i['id'] == id]
-          if len(i) > 1:
-            print 'there are two controls with id %s!' % id
-          else:
-            i = i[0]
-            try:
-              act = i['actions'][str(val)]
-              print 'just did action %s' % act
-            except KeyError:
-              print 'changed %s to %s but no associated action' % (id, val)
-
-            time.sleep(0.001)
-
-      # update the state
-      prev_state = new_state
+      state.poll()
+      for id, val in state.changes():
+        report_change(client, id, val)
 
       # deal with any messages from the server
-      if not client:
-        time.sleep(0.001)
-        continue
-
-      inst = client.get_instruction()
+      inst = client.get_instruction() if client else None
       while inst is not None:
-        if inst['type'] == 'display':
-          peripherals.DISPLAY.message = inst['message']
+        apply_instruction(board, inst)
 
-        elif inst['type'] == 'progress':
-          peripherals.RED_BAR.update_value(inst['message'] / 10)
-          peripherals.ORANGE_BAR.update_value(inst['message'] / 10)
+        # get next instruction
+        inst = client.get_instruction()
 
-        elif inst['type'] == 'status':
-          peripherals.DISPLAY.status = inst['message']
+      # flush any outputs which are due
+      if not threaded:
+        board.write_outputs(now)
 
-        elif inst['type'] == 'integrity':
-          peripherals.INTEGRITY.update(inst['message'])
+      # if there's time to spare before the next tick, clean up
+      if gc_guard:
+        gc_guard.tick(ticker.slack())
 
-        # get next instruction
-        inst = client.get_instruction()
+  finally:
+    print ticker
+    print board.bus_report()
+    if gc_guard:
+      print gc_guard
+      gc_guard.stop()
+
+    if board.workers:
+      for worker in board.workers:
+        print worker, worker.ticker
+        print worker.executive
+      board.stop_workers()
+    else:
+      print board.executive
+
+    if client:
+      client.stop()
+
+def run_evented(args):
+  """runs the whole console on one single-threaded event loop
+
+  The server connection is a non-blocking socket watched by the loop, and
+  peripheral comms and the systemd watchdog are periodic callbacks on it.
+  Everything stops, in one place, when the loop does."""
+  # load and initialize our peripherals
+  with PROFILE.step("build board"):
+    board = make_board(args)
+    state.load(board)
+  start_board(args, board)
+  start_export(args, board)
+
+  client = None
+  loop = EventLoop()
+  try:
+    # start communication with peripherals
+    board.read_all()
+
+    # initialize an announce message
+    announce = state.announce()
+
+    # initialize client connection
+    if '--local' in args:
+      print "Acting in local mode!"
+    else:
+      client = Client(SERVER_IP)
+      client.start_evented(announce)
+
+      def on_readable():
+        for inst in client.handle_read():
+          apply_instruction(board, inst)
+
+        # once the server hangs up, the socket is always readable; stop
+        # watching it, and let the watchdog notice the client has stopped
+        if not client.connected:
+          loop.remove_reader(client)
+          loop.remove_writer(client)
+
+      loop.add_reader(client, on_readable)
+      loop.add_writer(client, client.handle_write, client.wants_write)
+
+    # initialize systemd notifications
+    notifier = sdnotify.SystemdNotifier()
+
+    def watchdog():
+      if client and not client.running():
+        raise RuntimeError("The client has stopped!")
+
+      notifier.notify("WATCHDOG=1")
+
+    def tick():
+      now = clock.CLOCK.now()
+
+      # read inputs right before sending any changes, then flush outputs
+      board.read_inputs(now)
+
+      state.poll()
+      for id, val in state.changes():
+        report_change(client, id, val)
+
+      board.write_outputs(now)
+
+    loop.call_every(1.0 / tick_rate(args), tick)
+    loop.call_every(WATCHDOG_INTERVAL_SEC, watchdog)
+
+    # systemd stops us with SIGTERM; finish the current callback and clean up
+    signal.signal(signal.SIGTERM, lambda signum, frame: loop.stop())
+
+    notifier.notify("READY=1")
+    PROFILE.report()
+    loop.run()
 
   finally:
+    print loop
+    print board.executive
+    print board.bus_report()
+
     if client:
       client.stop()
 
 # run spaceteam!
-import sys
 if __name__ == "__main__":
   sys.exit(main(sys.argv[1:]))
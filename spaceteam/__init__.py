@@ -1,4 +1,3 @@
 """some stuff we want to put in the main module namespace"""
 
 from client import Client
-from peripheral_reader import PeripheralReader
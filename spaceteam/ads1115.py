@@ -31,6 +31,9 @@ SAMPLE_RATES = [8, 16, 32, 64, 128, 250, 475, 860]
 DEFAULT_SAMPLE_RATE = 128
 
 class ADS1115(object):
+  # we can't read faster than the sample rate anyway
+  RATE_HZ = 20
+
   def __init__(self, smbus, address, sps = DEFAULT_SAMPLE_RATE):
     self.smbus = smbus
     self.address = address
@@ -3,7 +3,10 @@
 
 import time
 
-class BarGraph(object):
+import clock
+from dirty import Dirtyable
+
+class BarGraph(Dirtyable):
   """Displays the given value on a bar of 10 LEDs on an ARRAY
 
     Passed values:
@@ -23,6 +26,8 @@ class BarGraph(object):
       'sweep',
       ]
 
+  RATE_HZ = 50 # frame rate; must be well above 1 / BLINK_INTERVAL
+
   BLINK_INTERVAL = 0.1 # in seconds
   SWEEP_INTERVAL = 0.5 # in seconds
   SWEEP_WIDTH = 1
@@ -37,8 +42,14 @@ class BarGraph(object):
     self._transition_time = 0
     self._blink_on = True
 
+    # what we last drew on the array, as (value, blink_on)
+    self._drawn = None
+
+  def __str__(self):
+    return "<BarGraph in %s mode>" % self.mode
+
   def _time_for_transition(self, interval):
-    t = time.time()
+    t = clock.CLOCK.now()
     if t > (self._transition_time + interval):
       self._transition_time = t
       return True
@@ -49,17 +60,30 @@ class BarGraph(object):
     if new_value < 0 or new_value > len(self.pins):
       raise ValueError(
           'BarGraph value must be between 0 and %s (got %d)' % (len(self.pins), new_value))
-    else:
+    elif new_value != self.value:
       self.value = new_value
+      self.mark_dirty()
 
   def communicate(self):
-    should_be_on = []
-
+    # advance any animation, and ask to be woken for the next step
     if self.mode == 'sweep':
-      # actually do the sweep
       if self._time_for_transition(self.SWEEP_INTERVAL):
-        self.update_value((self.value + 1) % len(self.pins))
+        self.value = (self.value + 1) % len(self.pins)
+      self.wake_at(self._transition_time + self.SWEEP_INTERVAL)
+
+    elif self.mode == 'countdown':
+      if self._time_for_transition(self.BLINK_INTERVAL):
+        self._blink_on = not self._blink_on
+      self.wake_at(self._transition_time + self.BLINK_INTERVAL)
+
+    # nothing to redraw?
+    drawn = (self.value, self._blink_on)
+    if drawn == self._drawn:
+      return
+    self._drawn = drawn
 
+    should_be_on = []
+    if self.mode == 'sweep':
       # figure out which LEDs should be on based on value
       should_be_on = [self.value]
       for i in xrange(self.SWEEP_WIDTH):
@@ -71,10 +95,6 @@ class BarGraph(object):
 
       # if we're blinking, the last-on led should blink
       if self.mode == 'countdown':
-        # manipulate internal blink state
-        if self._time_for_transition(self.BLINK_INTERVAL):
-          self._blink_on = not self._blink_on
-
         # turn the blinking led on/off
         blinking_idx = min(len(self.pins) - 1, self.value)
         if self._blink_on:
@@ -96,11 +116,12 @@ class BarGraph(object):
 
 if __name__ == "__main__":
   import peripherals
-  peripherals.reset_all()
+  board = peripherals.real_board()
+  board.reset_all()
 
   while True:
-    for bar in peripherals.BARS:
+    for bar in board.bars:
       bar.communicate()
 
-    peripherals.ARRAY.communicate()
+    board.array.communicate()
     time.sleep(0.5)
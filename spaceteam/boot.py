@@ -0,0 +1,109 @@
+#!/usr/bin/env python2.7
+"""Boots the board's devices concurrently, in dependency order
+
+The devices are on separate buses (the display on SPI, the Maple on the UART,
+the expanders on I2C, sound on the audio device), so there's no reason to
+bring them up one after another. Each stage of a BootGraph runs on its own
+thread as soon as the stages it comes after are done; run() waits for the
+ones we need and leaves the rest going in the background.
+"""
+
+import threading
+import time
+import traceback
+
+from startup import PROFILE
+
+class Stage(object):
+  """One step of booting; see BootGraph.add()"""
+  def __init__(self, name, func, after, wait):
+    self.name = name
+    self.func = func
+    self.after = after
+    self.wait = wait
+
+    self.done = threading.Event()
+    self.error = None
+    self.started = None
+    self.finished = None
+
+  def __str__(self):
+    if self.finished is None:
+      return "<Stage %s: not finished>" % self.name
+
+    outcome = "failed: %s" % self.error if self.error else "ok"
+    return "<Stage %s: %.3fs, %s>" % (self.name, self.finished - self.started, outcome)
+
+  def run(self):
+    try:
+      for stage in self.after:
+        stage.done.wait()
+        if stage.error:
+          raise RuntimeError("%s failed" % stage.name)
+
+      self.started = time.time()
+      with PROFILE.step(self.name):
+        self.func()
+
+    except Exception, e:
+      self.error = e
+      if self.started is None:
+        self.started = time.time()
+      else:
+        print "Boot stage %s failed: %s" % (self.name, e)
+        traceback.print_exc()
+
+    finally:
+      self.finished = time.time()
+      self.done.set()
+
+class BootGraph(object):
+  """Runs stages concurrently, each once the stages it comes after are done"""
+  def __init__(self):
+    self.stages = []
+    self.started = None
+
+  def add(self, name, func, after = [], wait = True):
+    """adds a stage calling func() once the stages in after are done
+
+    run() returns without waiting for stages added with wait = False; they
+    carry on in the background. Returns the stage, for use in after."""
+    stage = Stage(name, func, after, wait)
+    self.stages.append(stage)
+    return stage
+
+  def run(self):
+    """runs every stage; returns when all the ones we wait for are done
+
+    Raises RuntimeError if any of those failed."""
+    self.started = time.time()
+    for stage in self.stages:
+      thread = threading.Thread(target = stage.run, name = "boot-%s" % stage.name)
+      thread.daemon = True
+      thread.start()
+
+    failed = []
+    for stage in self.stages:
+      if stage.wait:
+        stage.done.wait()
+        if stage.error:
+          failed.append(stage.name)
+
+    if failed:
+      raise RuntimeError("Boot failed in %s" % ", ".join(failed))
+
+  def __str__(self):
+    lines = ["<BootGraph of %d stages>" % len(self.stages)]
+    for stage in self.stages:
+      if stage.finished is None:
+        lines.append("  %-24s still running" % stage.name)
+        continue
+
+      lines.append("  %-24s +%.3fs for %.3fs%s%s" % (
+          stage.name,
+          stage.started - self.started,
+          stage.finished - stage.started,
+          "" if stage.wait else " (background)",
+          " FAILED: %s" % stage.error if stage.error else ""))
+
+    return "\n".join(lines)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python2.7
+"""Checkpoints of what the board is showing, for warm restarts
+
+While we run, the checkpoint is a slow output which writes what the server
+told us to show (the display message, integrity and progress) to a file
+whenever it changes. Every led is drawn from that, from the controls (which
+redraw theirs on the first read) or by an animation, so none are saved; an
+idle board doesn't write at all. The file lives in the service's runtime
+directory, in memory and private to us (see spaceteam.service). When systemd
+restarts us after a
+crash, we load it back: if the devices still answer with the configuration we
+gave them, we skip the reset entirely and just put the outputs back the way
+they were, so the players never see the board go dark.
+"""
+
+import json
+import os
+import time
+
+DEFAULT_PATH = '/run/spaceteam/checkpoint.json'
+
+# older checkpoints are from some other game; don't restore them
+MAX_AGE_SEC = 60
+
+class Checkpoint(object):
+  """Saves (and restores) the output state of a board
+
+    Passed values:
+      board: the peripherals.Board to checkpoint
+      path: where to keep the checkpoint
+  """
+  # the outputs rarely change, and the file is small
+  RATE_HZ = 1
+
+  def __init__(self, board, path = DEFAULT_PATH):
+    self.board = board
+    self.path = path
+
+    self.saved = None
+    self.writes = 0
+    self.failed = False
+
+    # systemd makes the directory for the service; not when we're run by hand
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+      try:
+        os.makedirs(directory, 0700)
+      except OSError, e:
+        print "Can't make %s for checkpoints: %s" % (directory, e)
+
+  def __str__(self):
+    return "<Checkpoint at %s: %d writes>" % (self.path, self.writes)
+
+  def snapshot(self):
+    """the state of the board's outputs, as something json can save"""
+    board = self.board
+    return {
+        'message': board.display.message,
+        'integrity': board.integrity.value,
+        'progress': [board.red_bar.value, board.orange_bar.value],
+      }
+
+  def communicate(self):
+    """saves a checkpoint, if anything changed since the last one"""
+    state = self.snapshot()
+    if state == self.saved:
+      return
+
+    # wall-clock time, since it has to mean something to the next process
+    data = dict(state, saved_at = time.time())
+
+    # write the whole file aside, then swap it in, so a crash can't leave half of it
+    tmp_path = self.path + '.tmp'
+    try:
+      with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+      os.rename(tmp_path, self.path)
+      self.writes += 1
+    except (IOError, OSError), e:
+      if not self.failed:
+        print "Can't save checkpoints to %s: %s" % (self.path, e)
+      self.failed = True
+
+    # either way, don't try again until something else changes
+    self.saved = state
+
+  def load(self):
+    """the last checkpoint, if there is a recent one; otherwise None"""
+    try:
+      with open(self.path) as f:
+        data = json.load(f)
+    except (IOError, ValueError), e:
+      if os.path.exists(self.path):
+        print "Ignoring unreadable checkpoint %s: %s" % (self.path, e)
+      return None
+
+    age = time.time() - data.get('saved_at', 0)
+    if not 0 <= age <= MAX_AGE_SEC:
+      print "Ignoring checkpoint %s from %d seconds ago" % (self.path, age)
+      return None
+
+    return data
+
+  def restore(self, data):
+    """puts the board's outputs back the way they were in the checkpoint"""
+    board = self.board
+    board.display.message = data['message']
+    board.integrity.update(data['integrity'])
+
+    red, orange = data['progress']
+    board.red_bar.update_value(red)
+    board.orange_bar.update_value(orange)
+
+    # we just restored this state; no need to save it again
+    self.saved = self.snapshot()
@@ -3,13 +3,15 @@
 Acts as a client to a central control server
 """
 
+import errno
 import json
 import socket
 import struct
 import threading
-import time
 import Queue
 
+import clock
+
 DEFAULT_PORT = 8000
 
 class Client:
@@ -24,25 +26,55 @@ class Client:
 
     self.read_buffer = ''
 
+    # when running without a reader thread, unsent data waits here
+    self.evented = False
+    self.connected = False
+    self.write_buffer = ''
+
     self.recv_thread = None
     self.recv_stop = threading.Event()
     self.recv_events = Queue.Queue()
 
-    self.last_keepalive = time.time()
+    self.last_keepalive = clock.CLOCK.read()
 
   def start(self, announce):
     self._socket.connect((self.host, self.port))
+    self.connected = True
     self._send('announce', {'controls': announce})
 
     # start the reader thread
     self.recv_thread = threading.Thread(target = self._reader)
     self.recv_thread.start()
 
+  def start_evented(self, announce):
+    """like start, but without a reader thread
+
+    The socket is made non-blocking; whoever owns it should call handle_read()
+    when it's readable and handle_write() when it's writable and
+    wants_write() is true (see EventLoop.add_reader and add_writer)."""
+    self._socket.connect((self.host, self.port))
+    self.connected = True
+    self._send('announce', {'controls': announce})
+
+    self.evented = True
+    self._socket.setblocking(0)
+
+  def fileno(self):
+    return self._socket.fileno()
+
   def stop(self):
     if self.recv_thread:
       self.recv_stop.set()
+
+      # wake the reader from a blocking recv
+      try:
+        self._socket.shutdown(socket.SHUT_RDWR)
+      except socket.error:
+        pass
+
       self.recv_thread.join()
 
+    self.connected = False
     self._socket.close()
 
   def update(self, id, value):
@@ -55,9 +87,13 @@ class Client:
       return None
 
   def running(self):
-    recv_thread_alive = self.recv_thread and self.recv_thread.is_alive()
-    keepalive_happening = (time.time() - self.last_keepalive) < self.KEEPALIVE_THRESH_SEC
-    running = recv_thread_alive and keepalive_happening
+    if self.evented:
+      receiving = self.connected
+    else:
+      receiving = self.recv_thread and self.recv_thread.is_alive()
+
+    keepalive_happening = (clock.CLOCK.now() - self.last_keepalive) < self.KEEPALIVE_THRESH_SEC
+    running = receiving and keepalive_happening
 
     return running
 
@@ -67,41 +103,90 @@ class Client:
       'message': message,
       'data': data,
       })
-    self._socket.sendall(msg)
 
-  def _reader(self):
-    """performs the reading from the socket and handling messages"""
-    def parse_msg(msg):
-      if msg['message'] == 'set-display':
-        return {'type': 'display', 'message': msg['data']['message']}
+    if self.evented:
+      self.write_buffer += msg
+      self.handle_write()
+    else:
+      self._socket.sendall(msg)
 
-      elif msg['message'] == 'set-status':
-        return {'type': 'status', 'message': msg['data']['message']}
+  def wants_write(self):
+    return self.connected and len(self.write_buffer) > 0
 
-      elif msg['message'] == 'set-progress':
-        return {'type': 'progress', 'message': msg['data']['value']}
+  def handle_write(self):
+    """sends as much buffered data as the socket will take without blocking"""
+    try:
+      sent = self._socket.send(self.write_buffer)
+    except socket.error, e:
+      if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+        return
+      self.connected = False
+      raise
+
+    self.write_buffer = self.write_buffer[sent:]
+
+  def handle_read(self):
+    """reads whatever is available; returns a list of instructions received"""
+    try:
+      data = self._socket.recv(4096)
+    except socket.error, e:
+      if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+        return []
+      self.connected = False
+      raise
+
+    # the server hung up on us
+    if not data:
+      self.connected = False
+      return []
+
+    self.read_buffer += data
+    return list(self._parse_buffer())
+
+  def _parse_buffer(self):
+    """yields an instruction for every complete message in the buffer"""
+    msg = self.pop_from_buffer()
+    while msg:
+      event = self.parse_msg(msg)
+      if event:
+        yield event
+
+      # next message
+      msg = self.pop_from_buffer()
+
+  def parse_msg(self, msg):
+    """turns a message from the server into an instruction (or None)"""
+    if msg['message'] == 'set-display':
+      return {'type': 'display', 'message': msg['data']['message']}
 
-      elif msg['message'] == 'set-integrity':
-        return {'type': 'integrity', 'message': msg['data']['value']}
+    elif msg['message'] == 'set-status':
+      return {'type': 'status', 'message': msg['data']['message']}
 
-      elif msg['message'] == 'keep-alive':
-        self.last_keepalive = time.time()
+    elif msg['message'] == 'set-progress':
+      return {'type': 'progress', 'message': msg['data']['value']}
 
-      # unknown message
-      else:
-        return None
+    elif msg['message'] == 'set-integrity':
+      return {'type': 'integrity', 'message': msg['data']['value']}
 
+    elif msg['message'] == 'keep-alive':
+      self.last_keepalive = clock.CLOCK.read()
+
+    # unknown message
+    else:
+      return None
+
+  def _reader(self):
+    """performs the reading from the socket and handling messages"""
     while not self.recv_stop.isSet():
-      self.read_buffer += self._socket.recv(4096)
+      data = self._socket.recv(4096)
 
-      msg = self.pop_from_buffer()
-      while msg:
-        event = parse_msg(msg)
-        if event:
-          self.recv_events.put(event)
+      # the server hung up on us, or we were shut down
+      if not data:
+        break
 
-        # next message
-        msg = self.pop_from_buffer()
+      self.read_buffer += data
+      for event in self._parse_buffer():
+        self.recv_events.put(event)
 
   def pop_from_buffer(self):
     """parses a message read from the buffer"""
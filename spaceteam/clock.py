@@ -0,0 +1,101 @@
+#!/usr/bin/env python2.7
+"""The one clock everything in the console tells time by
+
+Components ask CLOCK.now(), which is read once per tick (by the ticker) rather
+than on every call, so everything that happens during a tick agrees on what
+time it is. Each thread has its own tick (the main loop and every bus worker
+run their own tickers), so now() is the time of the calling thread's last
+tick, never some other thread's. In production the clock is monotonic, so NTP adjusting the wall
+clock can't make blinks stall or keepalives expire. For simulations, install a
+SimulatedClock: sleeping on it just moves time forward, so hours of game can
+run in seconds.
+"""
+
+import ctypes
+import ctypes.util
+import threading
+import time
+
+class Clock(object):
+  """Base clock; subclasses provide read() and sleep()"""
+  def __init__(self):
+    # the time of each thread's last tick
+    self._ticked = threading.local()
+
+  def read(self):
+    """the current time, freshly read"""
+    raise NotImplementedError()
+
+  def sleep(self, seconds):
+    raise NotImplementedError()
+
+  def tick(self, at = None):
+    """reads the time (or takes at as the time); now() returns it, in this
+    thread, until the next tick"""
+    self._ticked.now = self.read() if at is None else at
+    return self._ticked.now
+
+  def now(self):
+    """the time as of this thread's last tick (or right now, if it doesn't tick)"""
+    now = getattr(self._ticked, 'now', None)
+    if now is None:
+      return self.read()
+
+    return now
+
+class _Timespec(ctypes.Structure):
+  _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+CLOCK_MONOTONIC = 1
+
+class MonotonicClock(Clock):
+  """Seconds since some fixed point, immune to changes of the wall clock
+
+  python 2.7 has no time.monotonic, so we ask libc; if we can't, we fall back
+  to the wall clock."""
+  def __init__(self):
+    Clock.__init__(self)
+
+    try:
+      self._clock_gettime = ctypes.CDLL(ctypes.util.find_library('c')).clock_gettime
+      self.read()
+    except (OSError, AttributeError):
+      print "no monotonic clock available; falling back to the wall clock"
+      self._clock_gettime = None
+
+  def read(self):
+    if self._clock_gettime is None:
+      return time.time()
+
+    # a fresh struct every time, since threads may be reading at once
+    timespec = _Timespec()
+    if self._clock_gettime(CLOCK_MONOTONIC, ctypes.byref(timespec)) != 0:
+      raise OSError("clock_gettime failed")
+
+    return timespec.tv_sec + timespec.tv_nsec * 1e-9
+
+  def sleep(self, seconds):
+    time.sleep(seconds)
+
+class SimulatedClock(Clock):
+  """A clock which only moves when told to; sleeping moves it instantly"""
+  def __init__(self, start = 0.0):
+    Clock.__init__(self)
+    self.time = start
+
+  def read(self):
+    return self.time
+
+  def sleep(self, seconds):
+    if seconds > 0:
+      self.time += seconds
+
+  advance = sleep
+
+# the clock shared by everything; see install()
+CLOCK = MonotonicClock()
+
+def install(clock):
+  """makes clock the one everything tells time by"""
+  global CLOCK
+  CLOCK = clock
@@ -0,0 +1,290 @@
+#!/usr/bin/env python2.7
+"""Loads the console's controls from controls.json
+
+The file declares every control: its id, its type, the pins and leds it uses,
+and the actions the server can ask for. Compiling it checks that it makes
+sense (ids are unique, and no pin or led is used twice) and indexes it by id.
+The compiled form is cached next to the file, so later boots just unpickle
+it; the cache is thrown away whenever the file changes. Unpickling runs code,
+so we only trust a cache nobody else could have written.
+
+Actions map a control's state (as a string) to what the server tells players
+to do. Besides plain "state": "action" entries, a table can hold templates,
+which are only expanded when the whole table is needed:
+
+  {"range": {"from": 0, "to": 999, "state": "%03d", "action": "Set course to %d!"}}
+  {"each": {"states": ["cerulean", "saffron"], "action": "Set shield modulation to %s"}}
+"""
+
+import cPickle as pickle
+import json
+import os
+import stat
+
+CONTROLS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'controls.json')
+# the cache of a controls file is the file's path plus this
+CACHE_SUFFIX = '.cache'
+
+# bump whenever the compiled form changes, to invalidate old caches
+COMPILED_VERSION = 2
+
+class ConfigError(ValueError):
+  """The controls file doesn't describe a console we can build"""
+  pass
+
+class ActionTable(object):
+  """What each state of a control means, with templates expanded on demand"""
+  def __init__(self, actions = None, ranges = None, eaches = None):
+    self.actions = actions or {}
+    self.ranges = ranges or []
+    self.eaches = eaches or []
+    self._expanded = None
+
+  def __getitem__(self, state):
+    if state in self.actions:
+      return self.actions[state]
+
+    for r in self.ranges:
+      n = _parse_int(state)
+      if n is not None and r['from'] <= n < r['to'] and r['state'] % n == state:
+        return r['action'] % n
+
+    for e in self.eaches:
+      if state in e['states']:
+        return e['action'] % state
+
+    raise KeyError(state)
+
+  def __contains__(self, state):
+    try:
+      self[state]
+    except KeyError:
+      return False
+
+    return True
+
+  def expand(self):
+    """every state and its action, as a dict (as the server wants them)"""
+    if self._expanded is None:
+      expanded = {}
+      for r in self.ranges:
+        for n in xrange(r['from'], r['to']):
+          expanded[r['state'] % n] = r['action'] % n
+      for e in self.eaches:
+        for state in e['states']:
+          expanded[state] = e['action'] % state
+      expanded.update(self.actions)
+
+      self._expanded = expanded
+
+    return self._expanded
+
+  def __getstate__(self):
+    # the expansion is cheap to redo, and would bloat the cache
+    state = dict(self.__dict__)
+    state['_expanded'] = None
+    return state
+
+def _parse_int(state):
+  try:
+    return int(state)
+  except (TypeError, ValueError):
+    return None
+
+# for each control type, its required and optional fields
+SWITCH_FIELDS = ['device', 'pin']
+SCHEMA = {
+    'Switch': (SWITCH_FIELDS, ['sounds', 'backwards']),
+    'SwitchWithPulldown': (SWITCH_FIELDS, ['sounds']),
+    'SwitchWithLight': (SWITCH_FIELDS + ['led_id'], ['sounds']),
+    'SwitchWithLed': (SWITCH_FIELDS + ['array_idx'], ['sounds', 'backwards', 'blink_int']),
+    'KeypadButton': (SWITCH_FIELDS + ['led_id'], []),
+    'Keypad': (['buttons', 'displays'], []),
+    'Throttle': (['first_led_id', 'led_count'], []),
+    'RotaryEncoder': (['switch_a', 'switch_b'], []),
+    'ShieldModulator': (['encoder', 'first_led'], ['led_count']),
+  }
+
+class _Compiler(object):
+  """Checks and normalizes control definitions, remembering what they use"""
+  def __init__(self):
+    self.pins = {}
+    self.strip_leds = {}
+    self.array_leds = {}
+
+  def claim(self, used, key, what, where):
+    if key in used:
+      raise ConfigError("%s %s is used by both %s and %s" % (what, key, used[key], where))
+    used[key] = where
+
+  def control(self, raw, where, kind = None):
+    """the compiled spec of one control (or part of one)"""
+    if not isinstance(raw, dict):
+      raise ConfigError("%s should be an object, not %r" % (where, raw))
+
+    kind = raw.get('type', kind)
+    if kind not in SCHEMA:
+      raise ConfigError("%s has unknown type %r" % (where, kind))
+
+    required, optional = SCHEMA[kind]
+    fields = set(raw.keys()) - set(['type'])
+    missing = set(required) - fields
+    if missing:
+      raise ConfigError("%s (a %s) is missing %s" % (where, kind, ", ".join(sorted(missing))))
+    unknown = fields - set(required) - set(optional)
+    if unknown:
+      raise ConfigError("%s (a %s) has unknown fields %s" % (where, kind, ", ".join(sorted(unknown))))
+
+    spec = dict(raw, type = kind)
+
+    if 'pin' in spec:
+      if not 0 <= spec['pin'] < 16:
+        raise ConfigError("%s uses pin %s, but expanders only have 16" % (where, spec['pin']))
+      self.claim(self.pins, "%s pin %d" % (spec['device'], spec['pin']), "Input", where)
+
+    if 'sounds' in spec:
+      spec['sounds'] = dict((_parse_bool(k, where), v) for k, v in spec['sounds'].items())
+
+    if 'led_id' in spec:
+      self.claim(self.strip_leds, spec['led_id'], "Strip led", where)
+    if 'array_idx' in spec:
+      self.claim(self.array_leds, spec['array_idx'], "Array led", where)
+
+    if kind == 'Throttle':
+      self.claim_strip_range(spec['first_led_id'], spec['led_count'], where)
+
+    elif kind == 'ShieldModulator':
+      spec['encoder'] = self.control(spec['encoder'], where + ".encoder", 'RotaryEncoder')
+      self.claim_strip_range(spec['first_led'], spec.get('led_count', 12), where)
+
+    elif kind == 'RotaryEncoder':
+      for part in ['switch_a', 'switch_b']:
+        spec[part] = self.control(spec[part], "%s.%s" % (where, part), 'Switch')
+
+    elif kind == 'Keypad':
+      buttons = {}
+      for label, button in spec['buttons'].items():
+        key = int(label) if label.isdigit() else label
+        buttons[key] = self.control(button, "%s.buttons.%s" % (where, label), 'KeypadButton')
+      spec['buttons'] = buttons
+
+      for idx, pins in enumerate(spec['displays']):
+        for segment, led in sorted(pins.items()):
+          self.claim(self.array_leds, led, "Array led", "%s.displays[%d].%s" % (where, idx, segment))
+
+    return spec
+
+  def claim_strip_range(self, first, count, where):
+    for led in xrange(first, first + count):
+      self.claim(self.strip_leds, led, "Strip led", where)
+
+  def actions(self, raw, where):
+    """the ActionTable for a control"""
+    table = ActionTable()
+    for state, action in raw.items():
+      if not isinstance(action, dict):
+        table.actions[state] = action
+      elif state == 'range':
+        table.ranges.append(action)
+      elif state == 'each':
+        table.eaches.append(action)
+      else:
+        raise ConfigError("%s has an unknown action template %r" % (where, state))
+
+    return table
+
+def _parse_bool(value, where):
+  if value not in ('True', 'False'):
+    raise ConfigError("%s: switch states are True or False, not %r" % (where, value))
+  return value == 'True'
+
+def compile_controls(raw):
+  """checks and indexes the parsed contents of a controls file
+
+  Returns {'controls': [...]}, where every control is {'id', 'control' (a spec
+  for state.build_control), 'actions' (an ActionTable)}"""
+  compiler = _Compiler()
+  controls = []
+  ids = set()
+  for position, c in enumerate(raw.get('controls', [])):
+    where = c.get('id', "control #%d" % position)
+    if 'id' not in c:
+      raise ConfigError("%s has no id" % where)
+    if c['id'] in ids:
+      raise ConfigError("There are two controls with id %s" % c['id'])
+
+    ids.add(c['id'])
+    controls.append({
+        'id': c['id'],
+        'control': compiler.control(c['control'], where),
+        'actions': compiler.actions(c.get('actions', {}), where),
+      })
+
+  return {'controls': controls}
+
+def _str(value):
+  """value from json with every unicode string encoded, like the rest of our strings"""
+  if isinstance(value, unicode):
+    return value.encode('utf-8')
+  if isinstance(value, list):
+    return [_str(v) for v in value]
+  if isinstance(value, dict):
+    return dict((_str(k), _str(v)) for k, v in value.items())
+  return value
+
+def _source_key(path):
+  info = os.stat(path)
+  return (COMPILED_VERSION, os.path.abspath(path), info.st_mtime, info.st_size)
+
+def _trusted(path):
+  """was path, and the directory it's in, only writable by us (or root)?"""
+  for checked in [path, os.path.dirname(os.path.abspath(path))]:
+    info = os.stat(checked)
+    if info.st_uid not in (os.getuid(), 0) or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+      return False
+
+  return True
+
+def load(path = None, cache_path = None):
+  """the compiled controls in path, from the cache if it's up to date
+
+  path defaults to CONTROLS_PATH, and cache_path to path + CACHE_SUFFIX;
+  pass cache_path = False to not cache at all"""
+  path = path or CONTROLS_PATH
+  if cache_path is None:
+    cache_path = path + CACHE_SUFFIX
+  key = _source_key(path)
+
+  if cache_path and os.path.exists(cache_path):
+    try:
+      if not _trusted(cache_path):
+        print "Not loading %s, since others could have written it" % cache_path
+      else:
+        with open(cache_path, 'rb') as f:
+          cached_key, compiled = pickle.load(f)
+        if cached_key == key:
+          return compiled
+    except Exception:
+      # stale or unreadable; we'll just compile afresh
+      pass
+
+  with open(path) as f:
+    try:
+      raw = _str(json.load(f))
+    except ValueError, e:
+      raise ConfigError("%s isn't valid json: %s" % (path, e))
+
+  compiled = compile_controls(raw)
+
+  if cache_path:
+    try:
+      tmp_path = cache_path + '.tmp'
+      fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+      with os.fdopen(fd, 'wb') as f:
+        pickle.dump((key, compiled), f, pickle.HIGHEST_PROTOCOL)
+      os.chmod(tmp_path, 0644)
+      os.rename(tmp_path, cache_path)
+    except (IOError, OSError), e:
+      print "Couldn't cache compiled controls in %s: %s" % (cache_path, e)
+
+  return compiled
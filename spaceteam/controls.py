@@ -3,17 +3,69 @@
 The collection of our various types of controls
 """
 
-import peripherals
 from colour import Color
-import time
 
-class Switch(object):
+import clock
+from mcp23017 import PIN_BITS
+
+class Control(object):
+  """Anything which can go in state.INPUTS
+
+  Controls are attached to the board whose sounds and leds they use. Once bound
+  to an id and a changes queue, a control appends (id, value) to the queue
+  whenever a read leaves it with a value it hasn't reported yet. That way the
+  main loop only has to look at controls that actually changed."""
+  def __init__(self):
+    self.board = None
+    self.id = None
+    self.changes = None
+    self.reported_value = None
+
+  def attach(self, board):
+    """use the devices on board (a peripherals.Board)"""
+    self.board = board
+    for control in self.children():
+      control.attach(board)
+
+  def children(self):
+    """any controls this one is made of"""
+    return []
+
+  def pins(self):
+    """(device, pin mask) for every expander pin this control reads"""
+    pins = []
+    for control in self.children():
+      pins.extend(control.pins())
+
+    return pins
+
+  def bind(self, id, changes):
+    """report future changes of value to the changes queue under id"""
+    self.id = id
+    self.changes = changes
+    self.reported_value = self.value
+
+  def report(self):
+    """call at the end of read(); queues our value if it's new"""
+    if self.changes is not None and self.value != self.reported_value:
+      self.reported_value = self.value
+      self.changes.append((self.id, self.value))
+
+class Switch(Control):
+  # how long the contacts may bounce after changing (see debounce.py); arcade
+  # microswitches are quick, rockers and toggles take longer
+  DEBOUNCE_SEC = 0.005
+
   def __init__(self, device, pin, sounds = None, backwards = False):
+    Control.__init__(self)
     self.device = device
     self.pin = pin
+    self.mask = PIN_BITS[pin]
     self.sounds = sounds
     self.backwards = backwards
 
+    self.debounce(self.DEBOUNCE_SEC)
+
     self.prev_value = None
     self.value = None
 
@@ -27,10 +79,19 @@ class Switch(object):
 
   def read(self):
     self.prev_value = self.value
-    self.value = self.device.read(self.pin)
+    self.value = self.device.read_mask(self.mask)
     self.play_sound()
 
     self.after_read()
+    self.report()
+
+  def pins(self):
+    return [(self.device, self.mask)]
+
+  def debounce(self, window_sec):
+    """ignore the switch for window_sec after it changes"""
+    self.debounce_sec = window_sec
+    self.device.set_debounce(self.pin, window_sec)
 
   def play_sound(self):
     if self.prev_value != self.value:
@@ -39,16 +100,18 @@ class Switch(object):
       except:
         pass
       else:
-        peripherals.SOUNDS.play(sound)
+        self.board.sounds.play(sound)
 
   def after_read(self):
     pass
 
 class SwitchWithPulldown(Switch):
   """Like a normal switch, but disables the pull-up on an MCP"""
+  DEBOUNCE_SEC = 0.02
+
   def __init__(self, device, pin, sounds = None):
     Switch.__init__(self, device, pin, sounds)
-    device.pullups[pin] = 0
+    device.set_pullup(pin, False)
 
 class SwitchWithLight(Switch):
   ACTIVE_COLOR = Color("green")
@@ -67,10 +130,12 @@ class SwitchWithLight(Switch):
   def set_color(self):
     new_color = self.ACTIVE_COLOR if self.active() else self.INACTIVE_COLOR
     if self.prev_color != new_color:
-      peripherals.MAPLE.set_led(self.led_id, new_color, latch = False)
+      self.board.maple.set_led(self.led_id, new_color, latch = False)
       self.prev_color = new_color
 
 class SwitchWithLed(Switch):
+  DEBOUNCE_SEC = 0.02
+
   def __init__(
       self, device, pin, array_idx, sounds = None, backwards = False, blink_int = 0):
     Switch.__init__(self, device, pin, sounds, backwards)
@@ -89,17 +154,18 @@ class SwitchWithLed(Switch):
     new_state = True if self.active() else False
 
     if self.blink_int > 0:
-      t = time.time()
+      t = clock.CLOCK.now()
       if (t - self.last_blink) > self.blink_int:
         self.last_blink = t
         self.blink_state = not self.blink_state
 
       new_state = new_state and self.blink_state
 
-    peripherals.ARRAY.set_led(self.array_idx, new_state)
+    self.board.array.set_led(self.array_idx, new_state)
 
 class KeypadButton(SwitchWithLight):
   """Just like a switch with a light, but calls a callback on press"""
+  DEBOUNCE_SEC = 0.01
 
   def __init__(self, device, pin, led_id):
     SwitchWithLight.__init__(self, device, pin, led_id)
@@ -110,7 +176,7 @@ class KeypadButton(SwitchWithLight):
     if self.prev_value != self.value:
       self.callback(self)
 
-class Keypad(object):
+class Keypad(Control):
   """A keypad; this is pretty specific to my board"""
   REQUIRED_KEYS = set([0,1,2,3,4,5,6,7,8,9,'input','ok'])
 
@@ -131,6 +197,8 @@ class Keypad(object):
           "Keypad requires a dictionary of buttons with exactly keys %s, but %s was provided" % (
             self.REQUIRED_KEYS, provided))
 
+    Control.__init__(self)
+
     # save ref to displays
     self.displays = displays
 
@@ -152,6 +220,12 @@ class Keypad(object):
     self.display = ['H', 'E', 'H']
     self.value = 0
 
+    # what the colors and displays were last set for
+    self.last_shown = None
+
+  def children(self):
+    return self.buttons.values()
+
   def callback_for(self, label):
     return lambda btn: self.key_pressed(label, btn)
 
@@ -217,27 +291,34 @@ class Keypad(object):
 
   def read(self):
     # handle blinking
-    now = time.time()
+    now = clock.CLOCK.now()
     if now > self.next_blink:
       self.next_blink = now + self.BLINK_INTERVAL_SEC
       self.blink_on_mode = not self.blink_on_mode
 
-    # set the button colors based on the current mode
-    self.set_button_colors()
+    # only touch the colors and the displays when something they depend on changed
+    shown = (self.input_mode, self.blink_on_mode, tuple(self.display))
+    if shown != self.last_shown:
+      self.last_shown = shown
+
+      # set the button colors based on the current mode
+      self.set_button_colors()
 
-    # make sure the display is correct
-    self.set_display()
+      # make sure the display is correct
+      self.set_display()
 
     # now lets read the inputs; that will set colors if necessary
     for btn in self.buttons.values():
       btn.read()
 
+    self.report()
+
   def set_display(self):
     for idx, char in enumerate(self.display):
       d = self.displays[idx]
       d.display(char)
 
-class Throttle(object):
+class Throttle(Control):
   """A bigass knife switch with a potentiometer and some leds under it."""
   UPDATE_INTERVAL = 0.2
   MIN_VAL = 0
@@ -245,6 +326,7 @@ class Throttle(object):
   CHANGE_THRESHOLD = 50
 
   def __init__(self, first_led_id, led_count):
+    Control.__init__(self)
     self.first_led_id = first_led_id
     self.led_count = led_count
 
@@ -280,11 +362,11 @@ class Throttle(object):
 
   def get_state(self):
     """reads the raw value of throttle from the microcontroller"""
-    t = time.time()
+    t = clock.CLOCK.now()
     if (t - self.last_state_grabbed) > self.UPDATE_INTERVAL:
       self.last_state_grabbed = t
       try:
-        state = peripherals.MAPLE.get_state()
+        state = self.board.maple.latest_state()
       except StandardError, e:
         print "Error reading throttle value: %s" % e
         return self.raw_value
@@ -300,9 +382,13 @@ class Throttle(object):
     # this prevents oscillating due to analog jitter
     new_raw_value = self.get_state()
     change = abs(new_raw_value - self.raw_value)
-    if change < self.CHANGE_THRESHOLD:
-      return
+    if change >= self.CHANGE_THRESHOLD:
+      self._update(new_raw_value)
+
+    self.report()
 
+  def _update(self, new_raw_value):
+    """takes on a new raw value, updating the leds and our value"""
     # save the raw value
     self.raw_value = new_raw_value
 
@@ -324,13 +410,20 @@ class Throttle(object):
     new_colors = [cur_color] * num_on    # these leds are on
     new_colors += [self.black] * (self.led_count - num_on) # these are off
 
-    peripherals.MAPLE.set_led_batch(self.first_led_id, new_colors)
+    self.board.maple.set_led_batch(self.first_led_id, new_colors)
 
-class RotaryEncoder(object):
+class RotaryEncoder(Control):
   """A rotary encoder!"""
+  # a fast spin changes the switches quicker than any window we could pick;
+  # read() ignores invalid transitions, which is our debouncing
+  DEBOUNCE_SEC = 0
+
   def __init__(self, switch_a, switch_b):
+    Control.__init__(self)
     self.switch_a = switch_a
     self.switch_b = switch_b
+    for switch in [switch_a, switch_b]:
+      switch.debounce(self.DEBOUNCE_SEC)
 
     self.last_transition = None
 
@@ -340,6 +433,9 @@ class RotaryEncoder(object):
     self.direction = 'clockwise'
     self.prev_direction = None
 
+  def children(self):
+    return [self.switch_a, self.switch_b]
+
   @property
   def value(self):
     return self.direction
@@ -401,7 +497,9 @@ class RotaryEncoder(object):
         else:
           self.last_transition = 'b'
 
-class ShieldModulator(object):
+    self.report()
+
+class ShieldModulator(Control):
   """A rotary encoder with a ring of LEDs around it"""
   COLORS = [
       {'name':'cerulean', 'color': Color('blue')},
@@ -415,6 +513,7 @@ class ShieldModulator(object):
   DIM_PCT = 0.1
 
   def __init__(self, encoder, first_led, led_count = 12):
+    Control.__init__(self)
     self.encoder = encoder
     self.first_led = first_led
     self.led_count = led_count
@@ -424,6 +523,12 @@ class ShieldModulator(object):
     self.value = None
     self.prev_value = None
 
+    # the colors for the ring with each led highlighted, built as needed
+    self._ring_colors = {}
+
+  def children(self):
+    return [self.encoder]
+
   def read(self):
     # read the current color index
     self.encoder.read()
@@ -439,18 +544,25 @@ class ShieldModulator(object):
     if self.cur_idx != self.prev_idx:
       self.prev_idx = self.cur_idx
 
-      # build an array of colors to populate the string
+      self.board.maple.set_led_batch(self.first_led, self.ring_colors(self.cur_idx))
+
+    self.report()
+    self.prev_value = self.value
+
+  def ring_colors(self, cur_idx):
+    """the colors to populate the string with when cur_idx is highlighted"""
+    if cur_idx not in self._ring_colors:
       new_colors = []
       for i in xrange(self.led_count):
         color_index = len(self.COLORS) * i / self.led_count
         color = Color(self.COLORS[color_index]['color'])
 
         # dim inactive colors
-        if i != self.cur_idx:
+        if i != cur_idx:
           color.luminance = color.luminance * self.DIM_PCT
 
         new_colors.append(color)
 
-      peripherals.MAPLE.set_led_batch(self.first_led, new_colors)
+      self._ring_colors[cur_idx] = new_colors
 
-    self.prev_value = self.value
+    return self._ring_colors[cur_idx]
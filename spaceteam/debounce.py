@@ -0,0 +1,86 @@
+#!/usr/bin/env python2.7
+"""Debounces the inputs of a port expander, a whole register at a time
+
+Mechanical contacts bounce for a few milliseconds when they switch; read raw,
+one press can look like several. We take a pin's first change straight away
+(so a press costs no latency) and then ignore the pin for its window. When the
+window is up, the pin takes whatever value it has settled on. A pin changing
+once during its window may just be a quick release, but any change after that
+is counted as a bounce.
+
+Pins are tracked as bits of a 16-bit mask, like MCP23017.input_bits, and we
+only ever loop over pins which are locked or just changed, so a quiet register
+costs a couple of integer operations however many pins it has.
+"""
+
+def bits_of(mask):
+  """yields each set bit of mask, lowest first"""
+  while mask:
+    bit = mask & -mask
+    yield bit
+    mask ^= bit
+
+def count_bits(mask):
+  return bin(mask).count('1')
+
+class Debouncer(object):
+  """Debounces one 16-bit register of inputs; see set_window()"""
+  def __init__(self):
+    self.windows = {}
+    # pins which have a window at all
+    self.debounced = 0
+
+    # the last raw value we saw, and what we report
+    self.raw = None
+    self.stable = None
+
+    # pins ignoring changes until the time in locked_until
+    self.locked = 0
+    self.locked_until = {}
+    # locked pins which have already changed once since they were locked
+    self.moved_in_lock = 0
+
+    self.bounces = 0
+
+  def set_window(self, bit, window_sec):
+    """ignore changes of the pin at bit for window_sec after it changes"""
+    if window_sec > 0:
+      self.windows[bit] = window_sec
+      self.debounced |= bit
+    else:
+      self.windows.pop(bit, None)
+      self.debounced &= ~bit
+
+  def sample(self, raw, now):
+    """takes a raw read of the register at time now; returns the debounced one"""
+    if self.stable is None:
+      self.raw = self.stable = raw
+      return raw
+
+    if self.locked:
+      for bit in bits_of(self.locked):
+        if self.locked_until[bit] <= now:
+          self.locked &= ~bit
+      self.moved_in_lock &= self.locked
+
+      # a locked pin's first change may be real; any after that are bouncing
+      moved = (raw ^ self.raw) & self.locked
+      if moved:
+        self.bounces += count_bits(moved & self.moved_in_lock)
+        self.moved_in_lock |= moved
+
+    self.raw = raw
+
+    moved = (raw ^ self.stable) & ~self.locked
+    if moved:
+      self.stable ^= moved
+      for bit in bits_of(moved & self.debounced):
+        self.locked_until[bit] = now + self.windows[bit]
+        self.locked |= bit
+      self.moved_in_lock &= ~moved
+
+    return self.stable
+
+  def settled(self):
+    """is no pin waiting out its window?"""
+    return not self.locked
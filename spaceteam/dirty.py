@@ -0,0 +1,60 @@
+#!/usr/bin/env python2.7
+"""Tracks which peripherals actually have something to do
+
+Most outputs are idle most of the time: the bars only change when they blink,
+the OLED only when there's a new message. Rather than calling communicate() on
+them every tick just for them to find nothing changed, a peripheral marks
+itself dirty when its inputs change, and asks to be woken at a given time when
+it has a timer (like a blink) running. The executive only runs what's dirty.
+"""
+
+class DirtyRegistry(object):
+  """The set of peripherals which need to run, plus timers to dirty them later"""
+  def __init__(self):
+    self.dirty = set()
+    self.wakeups = {}
+
+  def mark(self, peripheral):
+    self.dirty.add(peripheral)
+
+  def wake_at(self, peripheral, when):
+    """marks the peripheral dirty once time when has come"""
+    current = self.wakeups.get(peripheral)
+    if current is None or when < current:
+      self.wakeups[peripheral] = when
+
+  def take(self, now):
+    """returns every peripheral which is dirty at time now, clearing them"""
+    for peripheral, when in self.wakeups.items():
+      if when <= now:
+        del self.wakeups[peripheral]
+        self.dirty.add(peripheral)
+
+    # other threads may be marking peripherals as we go; pop is atomic
+    due = []
+    while self.dirty:
+      due.append(self.dirty.pop())
+
+    return due
+
+  def next_wakeup(self):
+    """the earliest time anything wants to run; now-ish if something's dirty"""
+    if self.dirty:
+      return 0
+
+    return min(self.wakeups.values()) if self.wakeups else None
+
+class Dirtyable(object):
+  """Mixin for peripherals which only need to run when something changed
+
+  The executive hands us a registry when we're scheduled; until then, marking
+  ourselves dirty does nothing (and communicate() is called by hand anyway)."""
+  registry = None
+
+  def mark_dirty(self):
+    if self.registry is not None:
+      self.registry.mark(self)
+
+  def wake_at(self, when):
+    if self.registry is not None:
+      self.registry.wake_at(self, when)
@@ -1,17 +1,36 @@
-from luma.core.render import canvas
-
-from PIL import ImageFont
 import os
 import textwrap
-import time
 
+import clock
 from utils import *
-
-class Display(object):
+from dirty import Dirtyable
+
+# luma and PIL take a while to import, so we only do it when a display starts;
+# without them (e.g. under pypy) displays keep track of messages but draw nothing
+canvas = None
+ImageFont = None
+
+def load_luma():
+  """imports luma and PIL, if we can; returns whether we could"""
+  global canvas, ImageFont
+  if canvas is None:
+    try:
+      from luma.core.render import canvas
+      from PIL import ImageFont
+    except ImportError:
+      return False
+
+  return True
+
+class Display(Dirtyable):
   FONT = 'inconsolata.ttf'
   FONT_SIZE = 12
   STATUS_TIME_SEC = 2 # how long to display status messages
 
+  # a few frames a second is plenty for text
+  RATE_HZ = 5
+  PHASE = 0.5
+
   def __init__(self):
     self.prev_message = None
     self.message = "Initializing navigation...."
@@ -19,12 +38,33 @@ class Display(object):
     self.status = None
     self.status_expires = None
 
-    self.font = self.get_font(self.FONT, self.FONT_SIZE)
-
-    # initialize in subclasses
+    # see start()
+    self.font = None
     self.device = None
+    self.started = False
+
+  @property
+  def message(self):
+    return self._message
+
+  @message.setter
+  def message(self, message):
+    self._message = message
+    self.mark_dirty()
+
+  @property
+  def status(self):
+    return self._status
+
+  @status.setter
+  def status(self, status):
+    self._status = status
+    self.mark_dirty()
 
   def get_font(self, name, size):
+    if canvas is None:
+      return None
+
     src_dir = os.path.dirname(__file__)
     font_dir = os.path.abspath(os.path.join(src_dir, '../fonts'))
     font_path = os.path.join(font_dir, name)
@@ -35,9 +75,24 @@ class Display(object):
     else:
       return ImageFont.load(font_path)
 
+  def start(self):
+    """gets the device going; this is slow, so it may be done on another thread
+
+    Nothing is drawn until we've started; then we're marked dirty to draw."""
+    device = None
+    if load_luma():
+      self.font = self.get_font(self.FONT, self.FONT_SIZE)
+      device = self.get_device()
+      if device is not None:
+        device.show()
+
+    # the device has to be in place before anyone sees we've started
+    self.device = device
+    self.started = True
+    self.mark_dirty()
+
   def reset(self):
-    self.device = self.get_device()
-    self.device.show()
+    self.start()
     self._write()
 
   def get_device(self):
@@ -50,7 +105,19 @@ class Display(object):
 
   def _write(self):
     # we have an unexpired status -- leave it on the screen
-    if self.status_expires and time.time() < self.status_expires:
+    if self.status_expires and clock.CLOCK.now() < self.status_expires:
+      self.wake_at(self.status_expires)
+      return
+
+    # not started yet; we'll be dirtied again once we have
+    if not self.started:
+      return
+
+    # no way to draw; just keep our state straight
+    if canvas is None or self.device is None:
+      self._status = None
+      self.status_expires = None
+      self.prev_message = self.message
       return
 
     with canvas(self.device) as draw:
@@ -62,9 +129,10 @@ class Display(object):
       # figure out what text to draw
       if self.status:
         self._draw_text(draw, self.status)
-        self.status = None
+        self._status = None
         self.prev_message = None
-        self.status_expires = time.time() + self.STATUS_TIME_SEC
+        self.status_expires = clock.CLOCK.now() + self.STATUS_TIME_SEC
+        self.wake_at(self.status_expires)
 
       # we should draw the current message
       else:
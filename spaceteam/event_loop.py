@@ -0,0 +1,134 @@
+#!/usr/bin/env python2.7
+"""A single-threaded, select()-based event loop
+
+Everything the console does is either "some bytes arrived" or "it's time to do
+X again", so one loop can run all of it: sockets are watched with select() and
+periodic jobs are kept on a heap of deadlines. Nothing blocks except the
+select() call itself, which sleeps exactly until the next thing is due.
+"""
+
+import errno
+import heapq
+import select
+
+import clock
+
+class Periodic(object):
+  """A callback run every interval seconds until cancelled"""
+  def __init__(self, interval, callback, name = None):
+    if interval <= 0:
+      raise ValueError("Interval must be positive (got %s)" % interval)
+
+    self.interval = interval
+    self.callback = callback
+    self.name = name or getattr(callback, '__name__', str(callback))
+
+    self.deadline = None
+    self.cancelled = False
+
+    self.runs = 0
+    self.late = 0
+
+  def __str__(self):
+    return "<Periodic %s every %.3fs: %d runs, %d late>" % (
+        self.name, self.interval, self.runs, self.late)
+
+  def cancel(self):
+    self.cancelled = True
+
+class EventLoop(object):
+  """Runs readers, writers and periodic callbacks until stopped"""
+  def __init__(self):
+    self.readers = {}
+    self.writers = {}
+    self.periodics = []
+    self._heap = []
+    self._running = False
+
+  def add_reader(self, fileobj, callback):
+    """calls callback() whenever fileobj is readable"""
+    self.readers[fileobj] = callback
+
+  def remove_reader(self, fileobj):
+    self.readers.pop(fileobj, None)
+
+  def add_writer(self, fileobj, callback, pending = lambda: True):
+    """calls callback() whenever fileobj is writable and pending() is true"""
+    self.writers[fileobj] = (callback, pending)
+
+  def remove_writer(self, fileobj):
+    self.writers.pop(fileobj, None)
+
+  def call_every(self, interval, callback, name = None, first = None):
+    """runs callback() every interval seconds, starting at time first (or now)"""
+    periodic = Periodic(interval, callback, name)
+    periodic.deadline = first if first is not None else clock.CLOCK.read()
+    heapq.heappush(self._heap, (periodic.deadline, periodic))
+    self.periodics.append(periodic)
+    return periodic
+
+  def stop(self):
+    """makes run() return once the current callback is done"""
+    self._running = False
+
+  def running(self):
+    return self._running
+
+  def run(self):
+    self._running = True
+    while self._running:
+      self._wait_for_io()
+      if self._running:
+        self._run_periodics()
+
+  def _wait_for_io(self):
+    timeout = None
+    if self._heap:
+      timeout = max(0, self._heap[0][0] - clock.CLOCK.read())
+
+    wanted_writers = [f for f, (_, pending) in self.writers.items() if pending()]
+    if not self.readers and not wanted_writers:
+      if timeout is not None:
+        clock.CLOCK.sleep(timeout)
+      return
+
+    try:
+      readable, writable, _ = select.select(self.readers.keys(), wanted_writers, [], timeout)
+    except select.error, e:
+      # a signal (say, SIGTERM calling stop()) interrupted us; run() checks
+      # whether we're still running and what's due, then waits again
+      if e.args[0] == errno.EINTR:
+        return
+      raise
+
+    for f in writable:
+      if f in self.writers:
+        self.writers[f][0]()
+    for f in readable:
+      if f in self.readers:
+        self.readers[f]()
+
+  def _run_periodics(self):
+    now = clock.CLOCK.tick()
+    while self._running and self._heap and self._heap[0][0] <= now:
+      deadline, periodic = heapq.heappop(self._heap)
+      if periodic.cancelled:
+        continue
+
+      periodic.callback()
+      periodic.runs += 1
+
+      # stay on the grid, but don't run a burst of callbacks to catch up
+      periodic.deadline = deadline + periodic.interval
+      if periodic.deadline <= now:
+        periodic.late += 1
+        periodic.deadline = now + periodic.interval
+
+      heapq.heappush(self._heap, (periodic.deadline, periodic))
+
+  def __str__(self):
+    lines = ["<EventLoop with %d periodic callbacks>" % len(self.periodics)]
+    for periodic in self.periodics:
+      lines.append("  %s" % periodic)
+
+    return "\n".join(lines)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python2.7
+"""Runs peripheral comms at rates chosen by each peripheral
+
+Every peripheral has a `communicate()` method, but they don't all need calling
+on every tick. Switches want to be read as often as possible, but the LED array
+only changes at a frame rate and nobody can read the OLED faster than a few
+times a second.
+
+Peripherals declare how often they want to run with a RATE_HZ attribute, and
+may declare a PHASE (a fraction of their period) to spread work across ticks.
+Tasks are grouped into stages, which always run in the order in STAGES; within
+a stage, tasks run in the order they were added.
+
+Peripherals which are Dirtyable only run when they've marked themselves dirty
+or one of their timers fired; for those, RATE_HZ is a cap rather than a rate.
+A peripheral dirtied by one which runs before it in the same stage (like the
+led array, when a bar graph redraws) runs in that same pass.
+"""
+
+import bisect
+
+from dirty import DirtyRegistry, Dirtyable
+
+STAGES = [
+    'input',  # read right before we compute state and send it to the server
+    'output', # flushed after we've applied any instructions from the server
+  ]
+
+DEFAULT_RATE_HZ = 50
+
+class Task(object):
+  """A single peripheral, scheduled at a fixed rate"""
+  # how early (as a fraction of the period) a task may run to line up with a tick
+  TOLERANCE = 0.1
+
+  def __init__(self, peripheral, rate_hz, phase = 0, order = 0):
+    if rate_hz <= 0:
+      raise ValueError("Rate for %s must be positive (got %s)" % (peripheral, rate_hz))
+    if phase < 0 or phase >= 1:
+      raise ValueError("Phase for %s must be in [0, 1) (got %s)" % (peripheral, phase))
+
+    self.peripheral = peripheral
+    self.rate_hz = rate_hz
+    self.period = 1.0 / rate_hz
+    self.phase = phase
+    self.order = order
+
+    # tracked tasks only run when their peripheral is dirty
+    self.tracked = isinstance(peripheral, Dirtyable)
+
+    self.next_due = None
+    self.runs = 0
+
+  def __cmp__(self, other):
+    return cmp(self.order, other.order)
+
+  def __str__(self):
+    return "<Task %s at %sHz>" % (self.peripheral, self.rate_hz)
+
+  def due(self, now):
+    if self.next_due is None:
+      self.next_due = now + self.phase * self.period
+
+    return now >= self.next_due - self.TOLERANCE * self.period
+
+  def run(self, now):
+    self.peripheral.communicate()
+    self.runs += 1
+
+    # stay on our own grid, but don't try to catch up on missed runs
+    self.next_due = max(
+        self.next_due + self.period,
+        now + self.period * (1 - self.TOLERANCE))
+
+class Executive(object):
+  """Schedules peripherals into stages at their declared rates"""
+  def __init__(self):
+    self.tasks = dict((stage, []) for stage in STAGES)
+    self.untracked = dict((stage, []) for stage in STAGES)
+    self.registries = dict((stage, DirtyRegistry()) for stage in STAGES)
+    self._task_for = {}
+
+    self.started = None
+    self.last_run = None
+
+  def add(self, peripheral, stage, rate_hz = None, phase = None):
+    """schedules the peripheral; rate and phase default to what it declares"""
+    if stage not in self.tasks:
+      raise ValueError("Unknown stage %s (must be one of %s)" % (stage, STAGES))
+
+    if rate_hz is None:
+      rate_hz = getattr(peripheral, 'RATE_HZ', DEFAULT_RATE_HZ)
+    if phase is None:
+      phase = getattr(peripheral, 'PHASE', 0)
+
+    task = Task(peripheral, rate_hz, phase, order = len(self._task_for))
+    self.tasks[stage].append(task)
+    self._task_for[peripheral] = task
+
+    if task.tracked:
+      # it reports to us from now on, and we want to run it at least once
+      peripheral.registry = self.registries[stage]
+      peripheral.mark_dirty()
+    else:
+      self.untracked[stage].append(task)
+
+    return task
+
+  def run(self, stage, now):
+    """runs every task in the stage which is due at time now
+
+    Only untracked tasks and dirty tracked ones are even looked at."""
+    if self.started is None:
+      self.started = now
+    self.last_run = now
+
+    registry = self.registries[stage]
+    queue = sorted(self.untracked[stage] + [self._task_for[p] for p in registry.take(now)])
+
+    next_idx = 0
+    while next_idx < len(queue):
+      task = queue[next_idx]
+      next_idx += 1
+
+      if task.due(now):
+        task.run(now)
+
+      elif task.tracked:
+        # we're over the rate cap; come back when we're allowed to run
+        registry.wake_at(task.peripheral, task.next_due - task.TOLERANCE * task.period)
+
+      if registry.dirty:
+        # what this task dirtied runs now if it's still to come, otherwise next time
+        for p in registry.take(now):
+          later = self._task_for[p]
+          if later.order <= task.order:
+            registry.mark(p)
+          elif later not in queue[next_idx:]:
+            bisect.insort(queue, later, next_idx)
+
+  def run_all(self, now):
+    for stage in STAGES:
+      self.run(stage, now)
+
+  def next_due(self, stages = STAGES):
+    """the earliest time at which any task in the stages wants to run again"""
+    due = []
+    for stage in stages:
+      due += [t.next_due for t in self.untracked[stage] if t.next_due is not None]
+
+      wakeup = self.registries[stage].next_wakeup()
+      if wakeup is not None:
+        due.append(wakeup)
+
+    return min(due) if due else None
+
+  def stats(self):
+    """how many times per second each peripheral actually ran"""
+    elapsed = (self.last_run - self.started) if self.started is not None else 0
+    stats = []
+    for stage in STAGES:
+      for task in self.tasks[stage]:
+        stats.append({
+          'peripheral': str(task.peripheral),
+          'stage': stage,
+          'rate_hz': task.rate_hz,
+          'actual_rate_hz': (task.runs / elapsed) if elapsed > 0 else 0,
+          })
+
+    return stats
+
+  def __str__(self):
+    lines = ["<Executive with %d tasks>" % sum(len(t) for t in self.tasks.values())]
+    for s in self.stats():
+      lines.append("  %-6s %-30s %6.1fHz (wanted %sHz)" % (
+        s['stage'], s['peripheral'], s['actual_rate_hz'], s['rate_hz']))
+
+    return "\n".join(lines)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python2.7
+"""Publishes the live state of the console into a memory-mapped file
+
+Local tools (dashboards, test harnesses) can map the same file and read the
+state whenever they like, without talking to us at all. The file has a fixed
+layout:
+
+  header     magic, version, and the counts which size everything below
+  seq, crc   the seqlock: seq is odd while a write is in progress
+  directory  the id of every control, written once
+  data       loop timing, control values, mcp latches, led array bytes, strip
+             colors and the raw throttle value
+
+The writer never waits on a reader. It bumps seq to odd, writes the data and
+its crc, and bumps seq to even again. A reader copies the data and keeps it
+only if seq was even and unchanged across the copy and the crc matches. The
+crc check means we don't need memory barriers, which python can't give us.
+
+Run this module to watch a console's state:
+
+  python -m spaceteam.export [path]
+"""
+
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+
+DEFAULT_PATH = '/dev/shm/spaceteam-state'
+
+MAGIC = 'STEX'
+VERSION = 1
+
+# magic, version, control count, mcp count, array bytes, strip leds
+HEADER = struct.Struct('<4sHHHHH')
+SEQLOCK = struct.Struct('<Ii')
+SEQLOCK_OFFSET = 16
+DIRECTORY_OFFSET = SEQLOCK_OFFSET + SEQLOCK.size
+
+ID_LEN = 32
+VALUE_LEN = 16
+
+# how many leds on the strip we publish colors for
+STRIP_LEDS = 64
+
+# updated_at, ticks, overruns, actual rate, mean jitter, worst jitter, worst overrun
+TIMING_FORMAT = 'dIIffff'
+TIMING_FIELDS = [
+    'updated_at',
+    'ticks',
+    'overruns',
+    'actual_rate_hz',
+    'mean_jitter_ms',
+    'worst_jitter_ms',
+    'worst_overrun_ms',
+  ]
+
+def data_struct(controls, mcps, array_len, strip_leds):
+  """the layout of the data section for a board of the given size"""
+  return struct.Struct('<' + ''.join([
+      TIMING_FORMAT,
+      '%ds' % VALUE_LEN * controls,
+      'BxHH' * mcps,           # address, input bits, which bits are inputs
+      '%ds' % array_len,
+      '%ds' % (strip_leds * 3),
+      'H',                     # raw throttle
+    ]))
+
+class StateExporter(object):
+  """Writes the state of a board and its controls into the export file
+
+    Passed values:
+      board: the peripherals.Board we're running
+      inputs: its controls, as in state.INPUTS
+      ticker: the main loop's ticker, for loop timing (or None)
+      path: the file to publish into; somewhere in /dev/shm keeps it in memory
+  """
+  # plenty for anything a person is watching
+  RATE_HZ = 20
+
+  def __init__(self, board, inputs, ticker = None, path = DEFAULT_PATH):
+    self.board = board
+    self.inputs = inputs
+    self.ticker = ticker
+    self.path = path
+
+    self.mcps = [p for p in board.inputs if hasattr(p, 'input_bits')]
+    self.throttles = [i['control'] for i in inputs if hasattr(i['control'], 'raw_value')]
+
+    self.data = data_struct(len(inputs), len(self.mcps), len(board.array.is_on), STRIP_LEDS)
+    self.data_offset = DIRECTORY_OFFSET + ID_LEN * len(inputs)
+    size = self.data_offset + self.data.size
+
+    # size the file and map it
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+    try:
+      os.ftruncate(fd, size)
+      self.map = mmap.mmap(fd, size)
+    finally:
+      os.close(fd)
+
+    # the parts which never change
+    HEADER.pack_into(self.map, 0, MAGIC, VERSION,
+        len(inputs), len(self.mcps), len(board.array.is_on), STRIP_LEDS)
+    for idx, i in enumerate(inputs):
+      start = DIRECTORY_OFFSET + idx * ID_LEN
+      self.map[start:start + ID_LEN] = i['id'][:ID_LEN].ljust(ID_LEN, '\0')
+
+    self.seq = 0
+    SEQLOCK.pack_into(self.map, SEQLOCK_OFFSET, self.seq, 0)
+
+  def __str__(self):
+    return "<StateExporter at %s: %d writes>" % (self.path, self.seq / 2)
+
+  def close(self):
+    if self.map is not None:
+      self.map.close()
+      self.map = None
+
+  def values(self):
+    """the current state, flattened into the order of the data section"""
+    if self.ticker:
+      stats = self.ticker.stats()
+      timing = [stats['ticks'], stats['overruns'], stats['actual_rate_hz'],
+          stats['mean_jitter_ms'], stats['worst_jitter_ms'], stats['worst_overrun_ms']]
+    else:
+      timing = [0] * (len(TIMING_FIELDS) - 1)
+
+    values = [time.time()] + timing
+
+    # controls hold their last-read value; we never read them ourselves
+    for i in self.inputs:
+      values.append(str(i['control'].value))
+
+    # the mcps keep their inputs packed just the way we publish them
+    for mcp in self.mcps:
+      bits = mcp.input_bits
+      if bits is None:
+        values.extend([mcp.address, 0, 0])
+      else:
+        values.extend([mcp.address, bits, mcp.input_mask])
+
+    values.append(str(self.board.array.is_on))
+
+    strip = bytearray(STRIP_LEDS * 3)
+    for number, rgb in self.board.maple.led_colors.items():
+      if 0 <= number < STRIP_LEDS:
+        strip[number * 3:number * 3 + 3] = bytearray(rgb)
+    values.append(str(strip))
+
+    values.append(self.throttles[0].raw_value if self.throttles else 0)
+    return values
+
+  def communicate(self):
+    """publishes the current state"""
+    data = self.data.pack(*self.values())
+    crc = zlib.crc32(data)
+
+    # odd while we write, so readers know to wait
+    self.seq = (self.seq + 1) & 0xFFFFFFFF
+    SEQLOCK.pack_into(self.map, SEQLOCK_OFFSET, self.seq, 0)
+
+    self.map[self.data_offset:self.data_offset + len(data)] = data
+
+    self.seq = (self.seq + 1) & 0xFFFFFFFF
+    SEQLOCK.pack_into(self.map, SEQLOCK_OFFSET, self.seq, crc)
+
+class StateReader(object):
+  """Reads consistent snapshots out of an export file"""
+  # how often to try before giving up on getting a consistent copy
+  MAX_TRIES = 100
+
+  def __init__(self, path = DEFAULT_PATH):
+    self.path = path
+
+    with open(path, 'rb') as f:
+      self.map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+    magic, version, controls, mcps, array_len, strip_leds = HEADER.unpack_from(self.map, 0)
+    if magic != MAGIC or version != VERSION:
+      raise ValueError("%s is not a version %d state export" % (path, VERSION))
+
+    self.ids = []
+    for idx in xrange(controls):
+      start = DIRECTORY_OFFSET + idx * ID_LEN
+      self.ids.append(self.map[start:start + ID_LEN].rstrip('\0'))
+
+    self.mcps = mcps
+    self.strip_leds = strip_leds
+    self.data = data_struct(controls, mcps, array_len, strip_leds)
+    self.data_offset = DIRECTORY_OFFSET + ID_LEN * controls
+
+  def close(self):
+    self.map.close()
+
+  def read(self):
+    """the raw data section, copied while nobody was writing it"""
+    end = self.data_offset + self.data.size
+    for _ in xrange(self.MAX_TRIES):
+      seq, _ = SEQLOCK.unpack_from(self.map, SEQLOCK_OFFSET)
+      if seq & 1:
+        continue
+
+      data = self.map[self.data_offset:end]
+      again, crc = SEQLOCK.unpack_from(self.map, SEQLOCK_OFFSET)
+      if again == seq and crc == zlib.crc32(data):
+        return seq, data
+
+    raise RuntimeError("Couldn't get a consistent read of %s" % self.path)
+
+  def snapshot(self):
+    """the exported state, as a dict"""
+    seq, data = self.read()
+    values = list(self.data.unpack(data))
+
+    state = {'seq': seq}
+    for field in TIMING_FIELDS:
+      state[field] = values.pop(0)
+
+    state['controls'] = dict((id, values.pop(0).rstrip('\0')) for id in self.ids)
+
+    state['mcps'] = {}
+    for _ in xrange(self.mcps):
+      address, bits, valid = values[0:3]
+      del values[0:3]
+      state['mcps'][address] = (bits, valid)
+
+    state['array'] = bytearray(values.pop(0))
+
+    strip = bytearray(values.pop(0))
+    state['strip'] = [list(strip[i:i + 3]) for i in xrange(0, len(strip), 3)]
+
+    state['throttle'] = values.pop(0)
+    return state
+
+if __name__ == "__main__":
+  reader = StateReader(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PATH)
+  while True:
+    state = reader.snapshot()
+    print "%d ticks at %.1fHz, %.1fs ago; throttle at %d" % (
+        state['ticks'], state['actual_rate_hz'], time.time() - state['updated_at'], state['throttle'])
+    for id, value in sorted(state['controls'].items()):
+      print "  %-32s %s" % (id, value)
+
+    time.sleep(1)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python2.7
+"""Keeps garbage collection out of the hot loop
+
+The cyclic garbage collector kicks in whenever enough container objects have
+been allocated, which can be right in the middle of reading the switches. In
+this mode we instead:
+
+  * collect everything once at startup, and freeze what's left (all the
+    controls and peripherals) out of the collector when the interpreter can,
+  * turn off automatic collection,
+  * collect the youngest generation ourselves, but only on ticks which have
+    enough slack left before the next deadline to absorb it,
+  * keep count of how many container objects each tick leaves behind, so that
+    code which starts allocating in the loop shows up in the stats.
+
+Reference counting still frees everything that isn't part of a cycle, so all
+this trades is *when* cycles get cleaned up.
+"""
+
+import gc
+import time
+
+class GcGuard(object):
+  """Runs collections only at safe points
+
+    Passed values:
+      min_slack_sec: only collect on ticks with at least this much time to spare
+      gen0_threshold: collect the young generation once this many objects piled up
+      full_every: every this many young collections, collect the older ones too
+  """
+  # collect regardless of slack once this many thresholds' worth have piled up
+  MAX_BACKLOG = 10
+
+  def __init__(self, min_slack_sec = 0.002, gen0_threshold = 700, full_every = 10):
+    self.min_slack_sec = min_slack_sec
+    self.gen0_threshold = gen0_threshold
+    self.full_every = full_every
+
+    self.ticks = 0
+    self.allocated = 0
+    self.worst_allocated = 0
+
+    self.collections = 0
+    self.collected = 0
+    self.worst_collection = 0
+
+    self._last_count = 0
+    self._was_enabled = None
+
+  def start(self):
+    """call once everything long-lived has been created"""
+    self._was_enabled = gc.isenabled()
+
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+      gc.freeze()
+
+    gc.disable()
+    self._last_count = gc.get_count()[0]
+
+  def stop(self):
+    if self._was_enabled:
+      gc.enable()
+
+  def tick(self, slack):
+    """call at the end of every tick, with the time left before the next one"""
+    # objects in the young generation are counted as allocations minus frees
+    count = gc.get_count()[0]
+    allocated = max(0, count - self._last_count)
+    self._last_count = count
+
+    self.ticks += 1
+    self.allocated += allocated
+    self.worst_allocated = max(self.worst_allocated, allocated)
+
+    # if we never get any slack, collect anyway rather than grow forever
+    if count >= self.gen0_threshold and slack >= self.min_slack_sec:
+      self.collect()
+    elif count >= self.gen0_threshold * self.MAX_BACKLOG:
+      self.collect()
+
+  def collect(self):
+    generation = 2 if (self.collections + 1) % self.full_every == 0 else 0
+
+    started = time.time()
+    self.collected += gc.collect(generation)
+    self.worst_collection = max(self.worst_collection, time.time() - started)
+
+    self.collections += 1
+    self._last_count = gc.get_count()[0]
+
+  def stats(self):
+    return {
+        'allocated_per_tick': (float(self.allocated) / self.ticks) if self.ticks else 0,
+        'worst_allocated': self.worst_allocated,
+        'collections': self.collections,
+        'collected': self.collected,
+        'worst_collection_ms': self.worst_collection * 1000,
+      }
+
+  def __str__(self):
+    stats = self.stats()
+    return "<GcGuard: %.1f objects/tick (worst %d), %d collections freed %d (worst %.1fms)>" % (
+        stats['allocated_per_tick'],
+        stats['worst_allocated'],
+        stats['collections'],
+        stats['collected'],
+        stats['worst_collection_ms'])
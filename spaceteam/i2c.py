@@ -0,0 +1,198 @@
+#!/usr/bin/env python2.7
+"""A pure-python I2C bus, talking to /dev/i2c-N with ioctls
+
+This does the same job as the `smbus` C extension (and has the same methods,
+for the subset we use), but only needs ctypes, so it also runs under PyPy.
+Every transfer is a single I2C_RDWR ioctl, so register reads are a proper
+write-then-read with a repeated start.
+
+More info:
+  https://www.kernel.org/doc/Documentation/i2c/dev-interface
+"""
+
+import ctypes
+import ctypes.util
+import os
+
+import clock
+
+# from linux/i2c-dev.h and linux/i2c.h
+I2C_FUNCS = 0x0705
+I2C_RDWR = 0x0707
+
+I2C_M_RD = 0x0001
+I2C_FUNC_I2C = 0x00000001
+
+# the most messages the kernel takes in one I2C_RDWR
+I2C_RDWR_MAX_MSGS = 42
+
+# the pi's default; set with dtparam=i2c_arm_baudrate in /boot/config.txt
+DEFAULT_CLOCK_HZ = 100000
+
+class I2CMessage(ctypes.Structure):
+  _fields_ = [
+      ('addr', ctypes.c_uint16),
+      ('flags', ctypes.c_uint16),
+      ('len', ctypes.c_uint16),
+      ('buf', ctypes.POINTER(ctypes.c_uint8)),
+    ]
+
+class I2CRdwrData(ctypes.Structure):
+  _fields_ = [
+      ('msgs', ctypes.POINTER(I2CMessage)),
+      ('nmsgs', ctypes.c_uint32),
+    ]
+
+_LIBC = None
+def _libc():
+  global _LIBC
+  if _LIBC is None:
+    _LIBC = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+    _LIBC.ioctl.argtypes = [ctypes.c_int, ctypes.c_ulong, ctypes.c_void_p]
+
+  return _LIBC
+
+def write_message(address, data):
+  """an I2C message which writes the given list of bytes"""
+  buf = (ctypes.c_uint8 * len(data))(*data)
+  return I2CMessage(address, 0, len(data), buf)
+
+def read_message(address, length):
+  """an I2C message which reads length bytes; see message_bytes()"""
+  buf = (ctypes.c_uint8 * length)()
+  return I2CMessage(address, I2C_M_RD, length, buf)
+
+def message_bytes(message):
+  """the bytes in a message's buffer, as a list"""
+  return message.buf[0:message.len]
+
+class BusTraffic(object):
+  """Counts what goes over a bus, to show how busy it is
+
+  The wire estimate counts 9 clocks per byte (8 bits and an ack), one address
+  byte per message and a couple of clocks for each start and stop. When it
+  gets near 100%, it's time to move devices to another bus."""
+  def __init__(self, clock_hz = DEFAULT_CLOCK_HZ):
+    self.clock_hz = clock_hz
+    # from the first transaction, so setup time doesn't dilute the rates
+    self.started = None
+
+    self.transactions = 0
+    self.messages = 0
+    self.bytes = 0
+    self.busy_sec = 0.0
+
+  def record(self, messages, data_bytes, seconds = 0):
+    """counts one transaction of messages carrying data_bytes, which took seconds"""
+    if self.started is None:
+      self.started = clock.CLOCK.read()
+
+    self.transactions += 1
+    self.messages += messages
+    self.bytes += data_bytes
+    self.busy_sec += seconds
+
+  def stats(self):
+    elapsed = 0 if self.started is None else clock.CLOCK.read() - self.started
+    if elapsed <= 0:
+      elapsed = float('inf')
+
+    clocks = 9 * (self.bytes + self.messages) + 2 * self.messages
+
+    return {
+      'transactions_per_sec': self.transactions / elapsed,
+      'bytes_per_sec': self.bytes / elapsed,
+      'busy_pct': 100 * self.busy_sec / elapsed,
+      'wire_pct': 100 * clocks / float(self.clock_hz) / elapsed,
+      }
+
+  def __str__(self):
+    stats = self.stats()
+    return "%.0f transactions/s, %.0f bytes/s, in transfers %.1f%% of the time, ~%.1f%% of the wire at %dkHz" % (
+        stats['transactions_per_sec'], stats['bytes_per_sec'], stats['busy_pct'], stats['wire_pct'],
+        self.clock_hz / 1000)
+
+class I2CBus(object):
+  """An I2C adapter; a drop-in for smbus.SMBus(bus_id)"""
+  def __init__(self, bus_id, clock_hz = DEFAULT_CLOCK_HZ):
+    self.bus_id = bus_id
+    self.path = "/dev/i2c-%d" % bus_id
+    self.fd = os.open(self.path, os.O_RDWR)
+    self.traffic = BusTraffic(clock_hz)
+
+  def __str__(self):
+    return "<I2CBus %s>" % self.path
+
+  def close(self):
+    if self.fd is not None:
+      os.close(self.fd)
+      self.fd = None
+
+  def functionality(self):
+    """the adapter's I2C_FUNC_* bitmask"""
+    funcs = ctypes.c_ulong()
+    self._ioctl(I2C_FUNCS, ctypes.byref(funcs))
+    return funcs.value
+
+  def transfer(self, messages):
+    """performs all the messages as a single combined transaction"""
+    msgs = (I2CMessage * len(messages))(*messages)
+    data = I2CRdwrData(msgs, len(messages))
+
+    started = clock.CLOCK.read()
+    self._ioctl(I2C_RDWR, ctypes.byref(data))
+    self.traffic.record(len(messages), sum(m.len for m in messages), clock.CLOCK.read() - started)
+
+    # the array holds copies of the messages, but they share buffers
+    return messages
+
+  def read_blocks(self, reads):
+    """reads every (address, register, length) in as few transactions as we can
+
+    Each read is a register write followed by a read with a repeated start,
+    and all of them go out in one I2C_RDWR (unless there are too many for the
+    kernel). Returns the bytes of each read, as lists, in order."""
+    replies = []
+    messages = []
+    for address, register, length in reads:
+      reply = read_message(address, length)
+      messages.extend([write_message(address, [register]), reply])
+      replies.append(reply)
+
+    for start in xrange(0, len(messages), I2C_RDWR_MAX_MSGS):
+      self.transfer(messages[start:start + I2C_RDWR_MAX_MSGS])
+
+    return [message_bytes(reply) for reply in replies]
+
+  def _ioctl(self, request, arg):
+    if _libc().ioctl(self.fd, request, arg) < 0:
+      err = ctypes.get_errno()
+      raise IOError(err, "%s on %s" % (os.strerror(err), self.path))
+
+  # the smbus.SMBus methods we use
+
+  def write_byte(self, address, value):
+    self.transfer([write_message(address, [value])])
+
+  def write_byte_data(self, address, register, value):
+    self.transfer([write_message(address, [register, value])])
+
+  def read_byte_data(self, address, register):
+    return self.read_i2c_block_data(address, register, 1)[0]
+
+  def write_word_data(self, address, register, value):
+    """like SMBus, words go out least-significant byte first"""
+    self.transfer([write_message(address, [register, value & 0xFF, (value >> 8) & 0xFF])])
+
+  def read_word_data(self, address, register):
+    """like SMBus, words come in least-significant byte first"""
+    lsb, msb = self.read_i2c_block_data(address, register, 2)
+    return (msb << 8) | lsb
+
+  def write_i2c_block_data(self, address, register, data):
+    self.transfer([write_message(address, [register] + list(data))])
+
+  def read_i2c_block_data(self, address, register, length):
+    reply = read_message(address, length)
+    self.transfer([write_message(address, [register]), reply])
+    return message_bytes(reply)
@@ -2,8 +2,13 @@
 
 import time
 
-class Integrity(object):
+from dirty import Dirtyable
+
+class Integrity(Dirtyable):
   """Displays hull integrity"""
+  RATE_HZ = 4
+  PHASE = 0.25
+
   def __init__(self, microcontroller, array, leds):
     self.micro = microcontroller
     self.array = array
@@ -12,6 +17,9 @@ class Integrity(object):
     self.value = 100
     self.last_value = None
 
+  def __str__(self):
+    return "<Integrity at %s%%>" % self.value
+
   def communicate(self):
     if self.value != self.last_value:
       self.last_value = self.value
@@ -33,16 +41,18 @@ class Integrity(object):
   def update(self, val):
     if val < 0 or val > 100:
       raise ValueError("integrity value must be between 0 and 100 (got %s)" % val)
-    else:
+    elif val != self.value:
       self.value = val
+      self.mark_dirty()
 
 if __name__ == "__main__":
   import peripherals
-  peripherals.reset_all()
+  board = peripherals.real_board()
+  board.reset_all()
 
   time.sleep(1)
 
-  itg = peripherals.INTEGRITY
+  itg = board.integrity
   for i in xrange(100):
     itg.update(100 - i)
     itg.communicate()
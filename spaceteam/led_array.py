@@ -9,10 +9,13 @@ the microcontroller...
 """
 
 from ctypes import c_ubyte
-import time
 
-class LedArray(object):
+import clock
+from dirty import Dirtyable
+
+class LedArray(Dirtyable):
   INSIDE_LED_PIN = 7
+  RATE_HZ = 50
 
   def __init__(self, microcontroller, chip_count = 1):
     self.microcontroller = microcontroller
@@ -28,14 +31,20 @@ class LedArray(object):
     # we have a clock
     self.last_advance = 0
 
+  def __str__(self):
+    return "<LedArray of %d chips>" % self.chip_count
 
   def turn_on(self, idx):
     byte, bit = self.__idx_to_byte_bit(idx)
-    self.is_on[byte] |= bit
+    if not self.is_on[byte] & bit:
+      self.is_on[byte] |= bit
+      self.mark_dirty()
 
   def turn_off(self, idx):
     byte, bit = self.__idx_to_byte_bit(idx)
-    self.is_on[byte] &= c_ubyte(~bit).value
+    if self.is_on[byte] & bit:
+      self.is_on[byte] &= c_ubyte(~bit).value
+      self.mark_dirty()
 
   def set_led(self, idx, on):
     if on:
@@ -48,6 +57,10 @@ class LedArray(object):
     active = (self.is_on[byte] & bit) != 0
     self.set_led(idx, not active)
 
+  def inside_leds(self):
+    """the idx of each inside led, which we run as a clock"""
+    return [self.INSIDE_LED_PIN + (16 * chip) for chip in range(self.chip_count)]
+
   def communicate(self):
     """Reads the state of all enabled pins and saves it locally"""
     self.__advance_inside_leds()
@@ -55,11 +68,14 @@ class LedArray(object):
       self.last_is_on = bytearray(self.is_on)
       self.microcontroller.update_array(list(self.is_on))
 
+    # wake up to advance the clock
+    self.wake_at(self.last_advance + 1)
+
   def __advance_inside_leds(self):
     """basically, a binary clock!"""
     # should we be advancing?
-    t = time.time()
-    if (time.time() - self.last_advance) < 1:
+    t = clock.CLOCK.now()
+    if (t - self.last_advance) < 1:
       return
 
     self.last_advance = t
@@ -72,8 +88,7 @@ class LedArray(object):
     inside_bits = format(self.inside_led_on, '0%db' % self.chip_count)
 
     # turn each of those leds on/off
-    for chip in range(self.chip_count):
-      inside_idx = self.INSIDE_LED_PIN + (16 * chip)
+    for chip, inside_idx in enumerate(self.inside_leds()):
       if inside_bits[chip] == '1':
         self.turn_on(inside_idx)
       else:
@@ -89,9 +104,10 @@ class LedArray(object):
 
 if __name__ == "__main__":
   import peripherals
-  peripherals.reset_all()
+  board = peripherals.real_board()
+  board.reset_all()
 
-  array = peripherals.ARRAY
+  array = board.array
 
   idx = 0
   while True:
@@ -7,10 +7,20 @@ More info:
 
 from utils import *
 
-import smbus
+import errno
+from collections import deque
+import clock
+from debounce import Debouncer
+from dirty import Dirtyable
+import i2c
 import time
 
+# in bank 0 (which we use) the registers come in A/B pairs, from IODIRA at 0x00
+# to OLATB at 0x15; IOCON shows up at both 0x0A and 0x0B
+REGISTER_COUNT = 0x16
+
 IOCON_ADDR = 0x0A
+IOCON_MIRROR_ADDR = 0x0B
 DESIRED_IOCON = [
     0, # Bank
     1, # Interrupt Mirror
@@ -25,6 +35,9 @@ DESIRED_IOCON = [
 IODIRA_ADDR = 0x00
 IODIRB_ADDR = 0x01
 
+IPOLA_ADDR = 0x02
+DEFVALA_ADDR = 0x06
+
 GPIOA_ADDR = 0x12
 GPIOB_ADDR = 0x13
 
@@ -34,54 +47,180 @@ OLATB_ADDR = 0x15
 GPPUA_ADDR = 0x0C
 GPPUB_ADDR = 0x0D
 
+GPINTENA_ADDR = 0x04
+GPINTENB_ADDR = 0x05
+
+INTCONA_ADDR = 0x08
+INTCONB_ADDR = 0x09
+
+# INTFA, INTFB, INTCAPA, INTCAPB, GPIOA and GPIOB are consecutive, so one
+# sequential read gets them all
+INTFA_ADDR = 0x0E
+INTERRUPT_READ_LEN = 6
+
+# the configuration registers, as (first register, count) to read in blocks;
+# they skip INTF, INTCAP and GPIO, which change and clear interrupts when read
+CONFIG_BLOCKS = [(IODIRA_ADDR, GPPUB_ADDR + 1), (OLATA_ADDR, 2)]
+
+# registers are 16 bits wide, port A in the top byte; the first pin of a port
+# is its most significant bit, so pin 0 is the top bit of the register
+PIN_BITS = [1 << (15 - pin) for pin in xrange(16)]
+ALL_PINS = 0xFFFF
+
+# how many reads another thread can get ahead of hold() before it drops the
+# oldest; the inputs still end up right, but a short press may be missed
+LATCHED_MAX = 32
+
+def split_ports(register):
+  """a 16-bit register as its (port A, port B) bytes"""
+  return (register >> 8, register & 0xFF)
+
 class MCP23017(object):
+  # inputs are polled as often as the main loop allows
+  RATE_HZ = 200
+
   def __init__(self, smbus, address):
     self.smbus = smbus
     self.address = address
 
-    self.input_latches = [None] * 16
-
-    self.inputs = [1] * 16
+    # the input pins as of the last read (output pins read as 0), or None
+    # before the first; reads swap in a new int, so whoever holds the
+    # previous one sees it left alone
+    self.input_bits = None
+
+    # what read() sees; normally just input_bits, but while holding (when
+    # another thread does the reading) only updated by hold(), so every
+    # control read in one tick sees the same snapshot
+    self.held_bits = None
+    self.holding = False
+    # did the last hold() (or read, when not holding) change held_bits?
+    self.held_changed = False
+    # while holding, each new value of input_bits, for hold() to step
+    # through; the reading thread only appends, and hold() only pops (keeping
+    # a value it popped too early in _deferred), so neither can lose one
+    self.latched = deque()
+    self._deferred = None
+
+    # which pins the last read found different from the one before
+    self.changed_bits = 0
+    self.changed = False
+
+    # the pins anything uses, and the (register, length) reading them takes
+    self.poll_mask = ALL_PINS
+    self.read_block = (GPIOA_ADDR, 2)
+
+    # filters bouncing contacts out of input_bits, once any pin wants it
+    self.debouncer = None
+
+    # IODIR; set bits are inputs
+    self.input_mask = ALL_PINS
     self.mode_changed = False
 
-    self.output_latches = [0] * 16
+    # OLAT
+    self.output_bits = 0
     self.output_latches_changed = False
 
-    self.pullups = [1] * 16
+    # GPPU
+    self.pullup_bits = ALL_PINS
+
+    # what we last wrote to (or read back from) each register, or None if we
+    # don't know; we only ever write registers which would change
+    self.shadow = [None] * REGISTER_COUNT
+
+    # with interrupts, the INT line goes high whenever an input changes
+    self.interrupts = False
+
+    # port values we've read but not yet latched (see latch_interrupt)
+    self.pending = deque(maxlen = 3)
+    # how many times INTCAP caught a change which GPIO no longer showed
+    self.captures = 0
 
   def __str__(self):
     return "<MCP23017 at {:x}>".format(self.address)
 
   def reset(self):
     """initializes us in a sane configuration"""
+    # whatever the chip has, we're about to write all of it
+    self.shadow = [None] * REGISTER_COUNT
+    self.mode_changed = False
+    self.output_latches_changed = False
+
+    # IOCON on its own first, since it decides how the block writes work
     self._set_iocon()
-    self._set_pin_modes()
-    self._enable_pullups()
-    self._write_output_latches()
+    self._write_registers(self.config())
+
+  def config(self):
+    """every configuration register as reset() would set it, by address"""
+    registers = {IOCON_ADDR: bitlist_to_int(DESIRED_IOCON)}
+    for register_a, value in [
+        (IODIRA_ADDR, self.input_mask),
+        (IPOLA_ADDR, 0),
+        (GPINTENA_ADDR, self._interrupt_mask()),
+        # interrupts compare against the previous value, rather than DEFVAL
+        (DEFVALA_ADDR, 0),
+        (INTCONA_ADDR, 0),
+        (GPPUA_ADDR, self.pullup_bits),
+        (OLATA_ADDR, self.output_bits),
+      ]:
+      registers.update(self._pair(register_a, value))
+
+    return registers
+
+  def verify(self):
+    """does the chip still have the configuration reset() would give it?
+
+    Reads every configuration register back, which also refreshes our shadow
+    copy of them."""
+    actual = {}
+    try:
+      for first, count in CONFIG_BLOCKS:
+        data = self.smbus.read_i2c_block_data(self.address, first, count)
+        actual.update(zip(xrange(first, first + count), data))
+    except IOError:
+      return False
+
+    for register, value in self.config().items():
+      if actual.get(register) != value:
+        # it's lost what we wrote, so we no longer know what it has
+        self.shadow = [None] * REGISTER_COUNT
+        return False
+
+    for register, value in actual.items():
+      self.shadow[register] = value
+
+    return True
 
   def read(self, pin):
     """returns pin value from inputs"""
+    return self.read_mask(PIN_BITS[pin])
+
+  def read_mask(self, mask):
+    """is any input pin in mask high? mask is a PIN_BITS value or several"""
+    bits = self.held_bits
+
     # something went wrong!
-    if self.input_latches[pin] is None:
-      if not self.inputs[pin]:
+    if bits is None or not mask & self.input_mask:
+      pins = ", ".join(str(pin) for pin in xrange(16) if mask & PIN_BITS[pin])
+      if not mask & self.input_mask:
         raise RuntimeError(
-            "Tried to read pin %s, but that pin is an output pin!" % pin)
+            "Tried to read pin %s, but that pin is an output pin!" % pins)
       else:
         raise RuntimeError(
-            "Tried to read pin %s, but it's state is not available!" % pin)
+            "Tried to read pin %s, but it's state is not available!" % pins)
 
-    # return the value
-    else:
-      return self.input_latches[pin]
+    return bool(bits & mask)
 
   def write(self, pin, value):
-    if self.inputs[pin] != 0:
+    if self.input_mask & PIN_BITS[pin]:
       raise RuntimeError("Tried to write %s to pin %s, but that pin is an input pin!" % (value, pin))
 
     if not value in ACCEPTABLE_BITS:
       raise RuntimeError("Value %s (written to MCP at %s pin %s) is not a valid bit" % (value, self.address, pin))
 
-    self.output_latches[pin] = value
+    if value:
+      self.output_bits |= PIN_BITS[pin]
+    else:
+      self.output_bits &= ~PIN_BITS[pin]
     self.output_latches_changed = True
 
   def communicate(self):
@@ -90,83 +229,459 @@ class MCP23017(object):
     This means reading the state of input pins and writing the new
     state of any output pins"""
     # first, perform any writes we need
+    self.write_changes()
+
+    # next, read the inputs
+    self._read_inputs()
+
+  def write_changes(self):
+    """writes any pin modes or output values which changed since last time"""
     if self.mode_changed:
       self._set_pin_modes()
     if self.output_latches_changed:
       self._write_output_latches()
 
-    # next, read the inputs
-    self._read_inputs()
-
   def set_as_output(self, pin):
-    if self.inputs[pin] != 0:
-      self.inputs[pin] = 0
+    if self.input_mask & PIN_BITS[pin]:
+      self.input_mask &= ~PIN_BITS[pin]
       self.mode_changed = True
 
   def set_as_input(self, pin):
-    if self.inputs[pin] != 1:
-      self.inputs[pin] = 1
+    if not self.input_mask & PIN_BITS[pin]:
+      self.input_mask |= PIN_BITS[pin]
+      self.mode_changed = True
+
+  def set_debounce(self, pin, window_sec):
+    """ignore the pin for window_sec after it changes (see debounce.py)"""
+    if self.debouncer is None:
+      self.debouncer = Debouncer()
+    self.debouncer.set_window(PIN_BITS[pin], window_sec)
+
+  @property
+  def bounces(self):
+    """how many bounces the debouncer has kept out of input_bits"""
+    return self.debouncer.bounces if self.debouncer else 0
+
+  def settled(self):
+    """is input_bits final, with no pin waiting out its debounce window?"""
+    return self.debouncer is None or self.debouncer.settled()
+
+  def settle(self):
+    """latches the last read again, for pins whose window has run out"""
+    self._latch(self.debouncer.raw)
+
+  def poll_only(self, mask):
+    """reads only the ports with pins in mask, or nothing at all if it's 0"""
+    self.poll_mask = mask
+    if mask & 0xFF00 and mask & 0x00FF:
+      self.read_block = (GPIOA_ADDR, 2)
+    elif mask & 0xFF00:
+      self.read_block = (GPIOA_ADDR, 1)
+    elif mask & 0x00FF:
+      self.read_block = (GPIOB_ADDR, 1)
+    else:
+      self.read_block = None
+
+    # only pins we poll should interrupt
+    if self.interrupts:
       self.mode_changed = True
 
+  def set_pullup(self, pin, enabled):
+    """takes effect on the next reset()"""
+    if enabled:
+      self.pullup_bits |= PIN_BITS[pin]
+    else:
+      self.pullup_bits &= ~PIN_BITS[pin]
+
+  def _pair(self, register_a, value):
+    """a 16-bit value as the A and B registers starting at register_a"""
+    port_a, port_b = split_ports(value)
+    return {register_a: port_a, register_a + 1: port_b}
+
   @retry_i2c
+  def _write_registers(self, registers):
+    """writes the registers (a dict of address to value) which would change
+
+    Runs of consecutive registers go out as one sequential block write. If a
+    write fails, the shadow only has what got written, so a retry picks up
+    where we left off."""
+    dirty = sorted(r for r, value in registers.items() if self.shadow[r] != value)
+
+    runs = []
+    for register in dirty:
+      if runs and runs[-1][-1] == register - 1:
+        runs[-1].append(register)
+      else:
+        runs.append([register])
+
+    for run in runs:
+      data = [registers[r] for r in run]
+      if len(data) == 1:
+        self.smbus.write_byte_data(self.address, run[0], data[0])
+      else:
+        self.smbus.write_i2c_block_data(self.address, run[0], data)
+
+      for r in run:
+        self.shadow[r] = registers[r]
+
   def _set_iocon(self):
     """set the controls we want for the rest of our interactions with the chip"""
-    self.smbus.write_byte_data(self.address, IOCON_ADDR, bitlist_to_int(DESIRED_IOCON))
+    iocon = bitlist_to_int(DESIRED_IOCON)
+    self._write_registers({IOCON_ADDR: iocon})
+    self.shadow[IOCON_MIRROR_ADDR] = iocon
 
-  @retry_i2c
   def _set_pin_modes(self):
     """configure pins as either inputs or outputs"""
     self.mode_changed = False
-    self.smbus.write_byte_data(
-        self.address,
-        IODIRA_ADDR,
-        bitlist_to_int(self.inputs[0:8]))
-    self.smbus.write_byte_data(
-        self.address,
-        IODIRB_ADDR,
-        bitlist_to_int(self.inputs[8:16]))
+    registers = self._pair(IODIRA_ADDR, self.input_mask)
+    registers.update(self._pair(GPINTENA_ADDR, self._interrupt_mask()))
+    self._write_registers(registers)
 
-  @retry_i2c
   def _write_output_latches(self):
     """for output pins, sets their output value from internal state"""
     self.output_latches_changed = False
-    self.smbus.write_byte_data(
-        self.address,
-        OLATA_ADDR,
-        bitlist_to_int(self.output_latches[0:8]))
-    self.smbus.write_byte_data(
-        self.address,
-        OLATB_ADDR,
-        bitlist_to_int(self.output_latches[8:16]))
+    self._write_registers(self._pair(OLATA_ADDR, self.output_bits))
 
   @retry_i2c
   def _read_inputs(self):
-    """Reads the state of input pins into a local register
+    """Reads the state of input pins into input_bits"""
+    # with sequential operation on (see DESIRED_IOCON), GPIOB follows GPIOA, so
+    # one transaction gets us both ports
+    if self.read_block is not None:
+      register, length = self.read_block
+      self.latch_read(self.smbus.read_i2c_block_data(self.address, register, length))
+
+  def latch_read(self, data):
+    """takes the bytes read from read_block; a port we don't read keeps its bits"""
+    if len(data) == 2:
+      self.latch_inputs(data[0], data[1])
+    else:
+      port_a, port_b = split_ports(self.input_bits or 0)
+      if self.read_block[0] == GPIOA_ADDR:
+        self.latch_inputs(data[0], port_b)
+      else:
+        self.latch_inputs(port_a, data[0])
 
-    Sets local register to a list of length 16, with states at 0 or 1 for input
-    pins or None for output pins"""
-    bits = []
-    for port in [GPIOA_ADDR, GPIOB_ADDR]:
-      data = self.smbus.read_byte_data(self.address, port)
-      port_bits = [x == '1' for x in format(data, "08b")]
-      bits += port_bits
+  @retry_i2c
+  def read_interrupt(self):
+    """reads INTF, INTCAP and GPIO of both ports, clearing any interrupt"""
+    return self.smbus.read_i2c_block_data(self.address, INTFA_ADDR, INTERRUPT_READ_LEN)
+
+  def latch_interrupt(self, data):
+    """takes INTF, INTCAP and GPIO of both ports, as read in one go
+
+    An input which changed and changed back before we got to read it shows up
+    in INTCAP but not in GPIO. Then we latch the captured values now and the
+    current ones on the next latch_pending(), so the controls see both changes."""
+    flag_a, flag_b, captured_a, captured_b, port_a, port_b = data
+    if flag_a or flag_b:
+      captured = (captured_a if flag_a else port_a, captured_b if flag_b else port_b)
+      if ((captured[0] ^ port_a) << 8 | (captured[1] ^ port_b)) & self.input_mask:
+        self.captures += 1
+        self.pending.append(captured)
+
+    self.pending.append((port_a, port_b))
+    self.latch_pending()
+
+  def latch_pending(self):
+    """latches the oldest port values we haven't yet"""
+    self.latch_inputs(*self.pending.popleft())
+
+  def latch_inputs(self, port_a, port_b):
+    """takes the values of GPIOA and GPIOB, however they were read"""
+    self._latch((port_a << 8 | port_b) & self.input_mask)
+
+  def _latch(self, bits):
+    if self.debouncer is not None:
+      bits = self.debouncer.sample(bits, clock.CLOCK.now())
+
+    previous = self.input_bits
+
+    self.changed_bits = self.input_mask if previous is None else bits ^ previous
+    self.changed = self.changed_bits != 0
+    self.input_bits = bits
+    if not self.holding:
+      self.held_bits = bits
+      self.held_changed = self.changed
+    elif self.changed:
+      self.latched.append(bits)
+
+  def hold(self):
+    """moves held_bits on to what's been read since the last hold()
+
+    From the first call on, read() only sees new inputs after a hold(). We
+    step through every value read meanwhile, as far as we can without a pin
+    changing twice; so a press and release between two holds shows up as a
+    press on one and a release on the next, rather than not at all."""
+    self.holding = True
+
+    # if the reader got too far ahead, skip the oldest values; we still end
+    # up at the latest
+    if len(self.latched) > LATCHED_MAX:
+      self._deferred = None
+      while len(self.latched) > LATCHED_MAX:
+        self.latched.popleft()
+
+    held = self.held_bits
+    moved = 0
+    while True:
+      bits, self._deferred = self._deferred, None
+      if bits is None:
+        try:
+          bits = self.latched.popleft()
+        except IndexError:
+          break
+
+      if held is not None and (bits ^ held) & moved:
+        self._deferred = bits
+        break
+
+      if held is not None:
+        moved |= bits ^ held
+      held = bits
+
+    self.held_changed = held != self.held_bits
+    self.held_bits = held
+
+  def _interrupt_mask(self):
+    """GPINTEN: every input pin we poll, if we're using interrupts"""
+    return self.input_mask & self.poll_mask if self.interrupts else 0
+
+class MCP23017Group(object):
+  """Every expander on one bus, read together in a single transaction
+
+  Reading each expander separately costs a transaction (and, on the pi, an
+  ioctl) apiece. If the bus can do combined transfers, we read every chip's
+  GPIO ports in one; otherwise, or if the combined read fails, each chip is
+  read on its own, as MCP23017.communicate() would. Some adapters (like the
+  pi's own) refuse a read anywhere but last in a transfer, so once the
+  adapter says it can't, or combined reads keep failing, we stop trying
+  them. Chips read only the ports
+  which have pins in use (see MCP23017.poll_only()), and chips with none
+  aren't read at all; call plan() after changing which pins those are.
+
+  Every so often we also read back one chip's configuration, in turn, so one
+  which browned out and lost it gets reset rather than read as garbage.
+
+    Passed values:
+      smbus: the bus all the expanders are on
+      mcps: the MCP23017s to read
+  """
+  RATE_HZ = MCP23017.RATE_HZ
+
+  # how often each chip's configuration gets checked
+  VERIFY_INTERVAL_SEC = 5
+
+  # after this many combined reads fail in a row, we only read one at a time
+  MAX_COMBINED_FAILURES = 3
+
+  def __init__(self, smbus, mcps):
+    self.smbus = smbus
+    self.mcps = mcps
+    self.plan()
 
-    # now bits contains 0s and 1s for each input, but we
-    # should ignore output pins
-    for pin, is_input in enumerate(self.inputs):
-      if not is_input:
-        bits[pin] = None
+    self.combined = self._supports_combined()
+    self.fallbacks = 0
+    self._failures_in_a_row = 0
 
-    self.input_latches = bits
+    self.next_verify = None
+    self._verify_idx = 0
+    self.resets = 0
 
-  @retry_i2c
-  def _enable_pullups(self):
-    """Enable pull-up resistors on all input pins"""
-    self.smbus.write_byte_data(
-        self.address,
-        GPPUA_ADDR,
-        bitlist_to_int(self.pullups[0:8]))
-    self.smbus.write_byte_data(
-        self.address,
-        GPPUB_ADDR,
-        bitlist_to_int(self.pullups[8:16]))
+    # did the last read find any expander's inputs changed?
+    self.changed = False
+
+  def __str__(self):
+    return "<MCP23017Group polling %d of %d on %s%s, %d bounces, %d resets>" % (
+        len(self.polled), len(self.mcps), self.smbus, "" if self.combined else " one at a time",
+        sum(mcp.bounces for mcp in self.mcps), self.resets)
+
+  def plan(self):
+    """works out which chips to read, and how much of each"""
+    self.polled = [mcp for mcp in self.mcps if mcp.read_block is not None]
+    self.reads = [(mcp.address,) + mcp.read_block for mcp in self.polled]
+
+  def _supports_combined(self):
+    if not hasattr(self.smbus, 'read_blocks'):
+      return False
+
+    try:
+      return bool(self.smbus.functionality() & i2c.I2C_FUNC_I2C)
+    except IOError:
+      return False
+
+  def _combined_failed(self, e):
+    """notes a failed combined read, giving up on them if they can't work"""
+    self.fallbacks += 1
+    self._failures_in_a_row += 1
+
+    if e.errno == errno.EOPNOTSUPP or self._failures_in_a_row >= self.MAX_COMBINED_FAILURES:
+      print "combined reads on %s don't work (%s); reading one at a time from now on" % (self.smbus, e)
+      self.combined = False
+    elif self._failures_in_a_row == 1:
+      # maybe one chip isn't answering; the caller will find out which
+      print "combined read of %s failed (%s); reading one at a time" % (self, e)
+
+  def check_health(self):
+    """verifies the next chip's configuration, if it's time; resets it if it's lost"""
+    now = clock.CLOCK.now()
+    if self.next_verify is not None and now < self.next_verify:
+      return
+
+    # spread the checks out, rather than reading every chip back at once
+    first = self.next_verify is None
+    self.next_verify = now + float(self.VERIFY_INTERVAL_SEC) / len(self.mcps)
+    if first:
+      return
+
+    mcp = self.mcps[self._verify_idx]
+    self._verify_idx = (self._verify_idx + 1) % len(self.mcps)
+    if not mcp.verify():
+      print "%s has lost its configuration; resetting it" % mcp
+      self.resets += 1
+      mcp.reset()
+
+  def communicate(self):
+    for mcp in self.mcps:
+      mcp.write_changes()
+    self.check_health()
+
+    if not (self.combined and self._read_combined()):
+      for mcp in self.polled:
+        mcp._read_inputs()
+
+    self.changed = any(mcp.changed for mcp in self.polled)
+
+  def _read_combined(self):
+    """reads every expander in one transaction; False if that didn't work"""
+    if not self.reads:
+      return True
+
+    try:
+      ports = self.smbus.read_blocks(self.reads)
+    except IOError, e:
+      self._combined_failed(e)
+      return False
+
+    self._failures_in_a_row = 0
+    for mcp, data in zip(self.polled, ports):
+      mcp.latch_read(data)
+
+    return True
+
+class MCP23017InterruptGroup(MCP23017Group, Dirtyable):
+  """Expanders whose INT lines we watch, read only when they signal a change
+
+  An edge on a chip's INT line (mirrored across both ports, active high; see
+  DESIRED_IOCON) marks the group dirty, so the executive runs it on the next
+  tick and we read just the chips which interrupted. Reading INTCAP as well
+  as GPIO means a press shorter than a tick isn't lost. In case we ever miss
+  an edge, every chip we poll is still read every POLL_INTERVAL_SEC.
+
+    Passed values:
+      smbus: the bus all the expanders are on
+      mcps: the MCP23017s to read
+      gpio: the set-up RPi.GPIO module, for watching the INT lines
+      pins: maps the address of each expander to the pin its INT line is on
+  """
+  # a safety net; an idle bus sees only this traffic
+  POLL_INTERVAL_SEC = 0.25
+
+  def __init__(self, smbus, mcps, gpio, pins):
+    MCP23017Group.__init__(self, smbus, mcps)
+    self.gpio = gpio
+    self.pins = pins
+    self.watching = False
+
+    for mcp in mcps:
+      mcp.interrupts = True
+
+    # the chips which interrupted since we last looked; the callbacks run on
+    # RPi.GPIO's thread, so we only ever add and pop
+    self.interrupted = set()
+    self.interrupts = 0
+    self.next_poll = None
+
+  def __str__(self):
+    return "<MCP23017InterruptGroup of %d on %s: %d interrupts, %d short presses, %d bounces, %d resets>" % (
+        len(self.mcps), self.smbus, self.interrupts,
+        sum(mcp.captures for mcp in self.mcps), sum(mcp.bounces for mcp in self.mcps), self.resets)
+
+  def watch(self):
+    """starts watching the INT lines; call once the chips are configured"""
+    if self.watching:
+      return
+
+    for mcp in self.mcps:
+      pin = self.pins[mcp.address]
+      self.gpio.setup(pin, self.gpio.IN, pull_up_down = self.gpio.PUD_DOWN)
+      self.gpio.add_event_detect(pin, self.gpio.RISING, callback = self._on_interrupt(mcp))
+
+    self.watching = True
+
+  def _on_interrupt(self, mcp):
+    def interrupted(channel):
+      self.interrupted.add(mcp)
+      self.interrupts += 1
+      self.mark_dirty()
+
+    return interrupted
+
+  def communicate(self):
+    for mcp in self.mcps:
+      mcp.write_changes()
+    self.check_health()
+
+    now = clock.CLOCK.now()
+    if self.next_poll is None or now >= self.next_poll:
+      self.interrupted.clear()
+      due = self.polled
+      self.next_poll = now + self.POLL_INTERVAL_SEC
+    else:
+      due = []
+      while self.interrupted:
+        due.append(self.interrupted.pop())
+
+    self.wake_at(self.next_poll)
+
+    if not (self.combined and self._read_interrupts(due)):
+      for mcp in due:
+        data = mcp.read_interrupt()
+        if data is not None:
+          mcp.latch_interrupt(data)
+
+    # chips with changes still to show, or debouncing, only need latching,
+    # not reading; the rest haven't changed since we last looked
+    for mcp in self.mcps:
+      if mcp in due:
+        continue
+      elif mcp.pending:
+        mcp.latch_pending()
+      elif not mcp.settled():
+        mcp.settle()
+      else:
+        mcp.changed_bits = 0
+        mcp.changed = False
+        if not mcp.holding:
+          mcp.held_changed = False
+
+    self.changed = any(mcp.changed for mcp in self.mcps)
+    if any(mcp.pending or not mcp.settled() for mcp in self.mcps):
+      self.mark_dirty()
+
+  def _read_interrupts(self, mcps):
+    """reads the chips in one transaction; False if that didn't work"""
+    if not mcps:
+      return True
+
+    try:
+      data = self.smbus.read_blocks([(mcp.address, INTFA_ADDR, INTERRUPT_READ_LEN) for mcp in mcps])
+    except IOError, e:
+      self._combined_failed(e)
+      return False
+
+    self._failures_in_a_row = 0
+    for mcp, d in zip(mcps, data):
+      mcp.latch_interrupt(d)
+
+    return True
@@ -1,27 +1,37 @@
 #!/usr/bin/python
 
 from cobs import cobs
+from collections import deque
 import io
 import select
 import serial
 import struct
 import threading
-import time
 
 from colour import Color
-from cmdmessenger import CmdMessenger
 
-class Microcontroller(object):
+import clock
+from dirty import Dirtyable
+
+class Microcontroller(Dirtyable):
   """interface to an on-board microcontroller"""
 
   # Timeout for buffered serial I/O in seconds.
   IO_TIMEOUT_SEC = 2
 
+  # how often we latch any led changes onto the strip
+  RATE_HZ = 50
+
+  # when buffered, how often communicate() fetches a fresh state
+  STATE_INTERVAL_SEC = 0.2
+
   def __init__(self, port, baud_rate=115200):
     """Connects to the microcontroller on a serial port.
 
     Args:
-        port: The serial port or path to a serial device.
+        port: The path to a serial device, or an already-open serial port
+            (anything with serial.Serial's read/write/close, like a
+            simulated.SimulatedSerial).
         baud_rate: The bit rate for serial communication.
 
     Raises:
@@ -29,13 +39,17 @@ class Microcontroller(object):
         SerialError: There is a configuration error.
     """
     # Build the serial wrapper.
-    self._serial = serial.Serial(
-        port=port,
-        baudrate=baud_rate,
-        bytesize=8,
-        parity='N',
-        stopbits=1,
-        timeout=self.IO_TIMEOUT_SEC)
+    if isinstance(port, basestring):
+      self._serial = serial.Serial(
+          port=port,
+          baudrate=baud_rate,
+          bytesize=8,
+          parity='N',
+          stopbits=1,
+          timeout=self.IO_TIMEOUT_SEC)
+    else:
+      self._serial = port
+
     if not self._serial.isOpen():
       raise ValueError("Couldn't open %s" % port)
 
@@ -52,10 +66,31 @@ class Microcontroller(object):
     # do we need to latch the leds?
     self.leds_updated = False
 
+    # the rgb bytes we last sent for each led on the strip, by led number
+    self.led_colors = {}
+
+    # when buffered, commands wait here until the next communicate()
+    self.outbox = None
+
+    # when buffered, the latest state fetched by communicate()
+    self.state = None
+    self.last_state_fetched = 0
+
+  def __str__(self):
+    return "<Microcontroller on %s>" % self._serial.port
+
   def stop(self):
     """Shuts down communication to the microcontroller."""
     self._serial.close()
 
+  def buffer_commands(self):
+    """queue commands instead of writing them; communicate() sends them
+
+    Use this when a dedicated thread owns the serial port: other threads can
+    then send commands without ever touching (or waiting on) the port."""
+    if self.outbox is None:
+      self.outbox = deque()
+
   def _send_command(self, data = []):
     """Sends a command to the microcontroller.
 
@@ -67,11 +102,26 @@ class Microcontroller(object):
           this doesn't guarantee the command was actually received.
     """
     encoded = cobs.encode(str(bytearray(data)))
-    self._serial.write(encoded + '\x00')
+    if self.outbox is not None:
+      self.outbox.append(encoded)
+      self.mark_dirty()
+    else:
+      self._serial.write(encoded + '\x00')
 
     self.commands_sent += 1
     return True
 
+  def _flush_outbox(self):
+    """writes any buffered commands to the port"""
+    if not self.outbox:
+      return
+
+    encoded = []
+    while self.outbox:
+      encoded.append(self.outbox.popleft())
+
+    self._serial.write('\x00'.join(encoded) + '\x00')
+
   def _reset_read_buf(self):
     self._read_buf[0:self._read_buf_pos] = [None] * self._read_buf_pos
     self._read_buf_pos = 0
@@ -113,6 +163,7 @@ class Microcontroller(object):
     """Updates the internal state with fresh data from the microcontroller"""
     # first, ask for a state update
     self._send_command('G')
+    self._flush_outbox()
 
     # we expect the microcontroller to respond quickly
     data = self._recv_command()
@@ -132,12 +183,34 @@ class Microcontroller(object):
   def communicate(self):
     """Performs two-ways comms with peripheral
 
-    In our case, this means syncing the local LED state with the remote LED state"""
+    In our case, this means syncing the local LED state with the remote LED state,
+    and when buffered, sending queued commands and refreshing our state"""
     if self.leds_updated:
       self.latch_leds()
 
+    if self.outbox is not None:
+      self._flush_outbox()
+
+      t = clock.CLOCK.now()
+      if (t - self.last_state_fetched) > self.STATE_INTERVAL_SEC:
+        self.last_state_fetched = t
+        self.state = self.get_state()
+
+      self.wake_at(self.last_state_fetched + self.STATE_INTERVAL_SEC)
+
+  def latest_state(self):
+    """like get_state(), but uses the state fetched by communicate() when buffered"""
+    if self.outbox is None:
+      return self.get_state()
+
+    if self.state is None:
+      raise RuntimeError("No state has been received from the microcontroller yet")
+
+    return self.state
+
   def clear_leds(self):
     """Clears (turns off) all of the leds"""
+    self.led_colors = {}
     self._send_command('C')
 
   def latch_leds(self):
@@ -147,8 +220,12 @@ class Microcontroller(object):
 
   def set_led(self, number, color, latch = False):
     """Sets as specific led to the given color; color is a Colour instance"""
-    command = ["O", number] + self.color_to_bit_list(color)
-    self._send_command(command)
+    self.set_led_bytes(number, self.color_to_bit_list(color), latch)
+
+  def set_led_bytes(self, number, rgb, latch = False):
+    """like set_led(), but with the rgb bytes color_to_bit_list() would give"""
+    self.led_colors[number] = rgb
+    self._send_command(["O", number] + rgb)
 
     self.latch_now_or_later(latch)
 
@@ -168,6 +245,8 @@ class Microcontroller(object):
       current = colors[:group_size]
       color_bytes_lists = [self.color_to_bit_list(c) for c in current]
       color_bytes = [item for sublist in color_bytes_lists for item in sublist]
+      for offset, rgb in enumerate(color_bytes_lists):
+        self.led_colors[first_led + offset] = rgb
       command = ["B", first_led] + color_bytes
       self._send_command(command)
 
@@ -182,6 +261,7 @@ class Microcontroller(object):
       self.latch_leds()
     else:
       self.leds_updated = True
+      self.mark_dirty()
 
   def color_to_bit_list(self, color):
     """converts a color into a list of rgb uint8_ts based on max_brightness"""
@@ -189,14 +269,15 @@ class Microcontroller(object):
 
 if __name__ == "__main__":
   import peripherals
-  peripherals.reset_all()
+  board = peripherals.real_board()
+  board.reset_all()
 
-  mic = peripherals.MAPLE
+  mic = board.maple
 
   idx = 0
   while True:
-    peripherals.MAPLE.set_led(idx, Color('orange'), latch = True)
+    mic.set_led(idx, Color('orange'), latch = True)
     raw_input("turned on %s; press <Enter> to continue..." % idx)
 
-    peripherals.MAPLE.set_led(idx, Color('green'), latch = False)
+    mic.set_led(idx, Color('green'), latch = False)
     idx += 1
@@ -1,16 +1,19 @@
 #!/usr/bin/env python2.7
 """
-Initializes and provides access to board peripherals
+The peripherals on the board, and the backends they talk through
+
+Nothing here touches hardware on import; build a Board with real_board() (or
+simulated_board(), which needs no hardware at all) and use its devices.
 """
 
 import atexit
-import smbus
 import time
 
-# initialize GPIO
-import RPi.GPIO as GPIO
-GPIO.setmode(GPIO.BOARD)
-atexit.register(GPIO.cleanup)
+# without GPIO (say, under pypy) we can't use the reset line or the display
+try:
+  import RPi.GPIO as GPIO
+except ImportError:
+  GPIO = None
 
 # all pin numbers are BOARD
 RESET_PIN = 36
@@ -21,35 +24,24 @@ I2C_SOFT_RESET = 0x06 # all devices reset
 def all_call_reset(bus):
   bus.write_byte(I2C_ALL_CALL, I2C_SOFT_RESET)
 
-# initialize I2C
+# the I2C bus the port expanders are on
+from i2c import I2CBus
 BUS_ID = 1
-_SMBUS = smbus.SMBus(BUS_ID)
+
+# expanders on some other bus (the pi's other hardware bus, or an
+# i2c-gpio one), by address; each bus is read concurrently by its own worker
+EXPANDER_BUSES = {}
 
 # these pins are not used in the code, just here for reference
 SMBUS_SDA_PIN = 03
 SMBUS_SCL_PIN = 05
 
-# not used atm
-from ads1115 import ADS1115
+# the pin each expander's INT line is wired to, by address; expanders which
+# aren't wired up are polled
+INTERRUPT_PINS = {}
 
-from mcp23017 import MCP23017
-MCP20 = MCP23017(_SMBUS, 0x20)
-MCP21 = MCP23017(_SMBUS, 0x21)
-MCP22 = MCP23017(_SMBUS, 0x22)
-MCP26 = MCP23017(_SMBUS, 0x26)
-MCP27 = MCP23017(_SMBUS, 0x27)
-
-INPUTS = [
-    MCP20,
-    MCP21,
-    MCP22,
-    MCP26,
-    MCP27,
-    ]
-
-# initialize microcontroller
-from microcontroller import Microcontroller
-MAPLE = Microcontroller("/dev/serial0")
+# the microcontroller's serial port
+SERIAL_PORT = "/dev/serial0"
 
 # these pins are not used in the code, just here for reference
 MICROCONTROLLER_TX_PIN = 8
@@ -62,81 +54,362 @@ DISPLAY_MOSI_PIN = 19         # pin 5  these pins are port 0
 DISPLAY_CE_PIN = 24           # harness pin 6; this is CE0, so we get device 0
 DISPLAY_RESET_PIN = RESET_PIN # pin 7; we pass NONE to device since we do reset ourselves
 
-from ssd1325 import SSD1325
-DISPLAY = SSD1325(gpio = GPIO, gpio_DC = 29, gpio_RST = None)
+# not used atm
+from ads1115 import ADS1115
 
+from bar_graph import BarGraph
+from boot import BootGraph
+from executive import Executive
+from integrity import Integrity
 from led_array import LedArray
-ARRAY = LedArray(MAPLE, 5)
-ARRAY.turn_on(41) # nuke warning
-ARRAY.turn_on(40) # signal light
+from mcp23017 import MCP23017, MCP23017Group, MCP23017InterruptGroup
+from microcontroller import Microcontroller
+from sound_player import SoundPlayer
+from ssd1325 import SSD1325
+from startup import PROFILE, in_background
+from workers import BusWorker
 
-from integrity import Integrity
-INTEGRITY = Integrity(MAPLE, ARRAY, [45, 36, 35])
+_GPIO_READY = False
+def setup_gpio():
+  """the GPIO module, set up for BOARD pin numbers; None if we don't have one"""
+  global _GPIO_READY
+  if GPIO is not None and not _GPIO_READY:
+    GPIO.setmode(GPIO.BOARD)
+    atexit.register(GPIO.cleanup)
+    _GPIO_READY = True
 
-from bar_graph import BarGraph
-RED_BAR = BarGraph(ARRAY, [51, 49, 48, 53, 70, 50, 61, 69, 67, 52], 'countdown')
-GREEN_BAR = BarGraph(ARRAY, [68, 73, 74, 65, 54, 76, 79, 64, 77, 62], 'sweep')
-ORANGE_BAR = BarGraph(ARRAY, [34, 38, 16, 37, 75, 43, 78, 63, 72, 66], 'countdown')
-DOT_BAR = BarGraph(ARRAY, [4, 22, 12], 'sweep')
-BARS = [
-    RED_BAR,
-    GREEN_BAR,
-    ORANGE_BAR,
-    ]
-
-OUTPUTS = BARS + [
-    DISPLAY,
-    INTEGRITY,
-    ARRAY,
-    MAPLE,
-    ]
+  return GPIO
 
-from sound_player import SoundPlayer
-SOUNDS = SoundPlayer()
-
-ALL = INPUTS + OUTPUTS
-def read_all():
-  for p in ALL:
-    p.communicate()
-
-def toggle_reset():
-  GPIO.setup(RESET_PIN, GPIO.OUT)
-  GPIO.output(RESET_PIN, 0)
-  time.sleep(0.1)
-  GPIO.output(RESET_PIN, 1)
-
-def reset_all():
-  """resets all peripherals"""
-  toggle_reset()
-
-  # initialize the display
-  DISPLAY.reset()
-
-  # reset the MAPLE
-  MAPLE.reset()
-  tries = 0
-  while tries < 5:
+class Board(object):
+  """Every device on one console, talking through the given backends
+
+    Passed values:
+      i2c: the bus the port expanders are on (an I2CBus, or a SimulatedI2CBus)
+      serial: the microcontroller's port; a device path, or a serial-like object
+      gpio: the set-up GPIO module; without it there is no display or reset line
+      sound: whether to play sounds out loud
+      interrupt_pins: maps expander addresses to the pins their INT lines are
+        on; those expanders are only read when they interrupt (needs gpio)
+      expander_buses: maps expander addresses to the bus they're on, if that
+        isn't i2c
+  """
+  def __init__(self, i2c, serial, gpio = None, sound = True, interrupt_pins = {}, expander_buses = {}):
+    self.i2c = i2c
+    self.gpio = gpio
+
+    self.mcp20 = MCP23017(expander_buses.get(0x20, i2c), 0x20)
+    self.mcp21 = MCP23017(expander_buses.get(0x21, i2c), 0x21)
+    self.mcp22 = MCP23017(expander_buses.get(0x22, i2c), 0x22)
+    self.mcp26 = MCP23017(expander_buses.get(0x26, i2c), 0x26)
+    self.mcp27 = MCP23017(expander_buses.get(0x27, i2c), 0x27)
+
+    self.inputs = [
+        self.mcp20,
+        self.mcp21,
+        self.mcp22,
+        self.mcp26,
+        self.mcp27,
+      ]
+
+    if interrupt_pins and gpio is None:
+      print "GPIO is not available; polling the expanders instead of using interrupts"
+      interrupt_pins = {}
+
+    # the expanders on each bus are read together, in one transaction if the
+    # bus can; those with their INT lines wired up only when they interrupt
+    mcps = [p for p in self.inputs if type(p) == MCP23017]
+    self.i2c_buses = [i2c]
+    for mcp in mcps:
+      if mcp.smbus not in self.i2c_buses:
+        self.i2c_buses.append(mcp.smbus)
+
+    self.expanders = []
+    bus_readers = {}
+    for bus in self.i2c_buses:
+      on_bus = [mcp for mcp in mcps if mcp.smbus is bus]
+      watched = [mcp for mcp in on_bus if mcp.address in interrupt_pins]
+
+      groups = []
+      if watched:
+        groups.append(MCP23017InterruptGroup(bus, watched, gpio, interrupt_pins))
+      if len(watched) < len(on_bus):
+        groups.append(MCP23017Group(bus, [mcp for mcp in on_bus if mcp not in watched]))
+
+      self.expanders.extend(groups)
+      bus_readers[bus] = groups
+
+    # anything else on the main bus is read by itself
+    bus_readers[i2c] = bus_readers[i2c] + [p for p in self.inputs if type(p) != MCP23017]
+
+    # what actually gets scheduled to read the inputs
+    self.readers = [reader for bus in self.i2c_buses for reader in bus_readers[bus]]
+
+    self.maple = Microcontroller(serial)
+    self.display = SSD1325(gpio = gpio, gpio_DC = DISPLAY_DC_PIN, gpio_RST = None)
+
+    self.array = LedArray(self.maple, 5)
+    self.array.turn_on(41) # nuke warning
+    self.array.turn_on(40) # signal light
+
+    self.integrity = Integrity(self.maple, self.array, [45, 36, 35])
+
+    self.red_bar = BarGraph(self.array, [51, 49, 48, 53, 70, 50, 61, 69, 67, 52], 'countdown')
+    self.green_bar = BarGraph(self.array, [68, 73, 74, 65, 54, 76, 79, 64, 77, 62], 'sweep')
+    self.orange_bar = BarGraph(self.array, [34, 38, 16, 37, 75, 43, 78, 63, 72, 66], 'countdown')
+    self.dot_bar = BarGraph(self.array, [4, 22, 12], 'sweep')
+    self.bars = [
+        self.red_bar,
+        self.green_bar,
+        self.orange_bar,
+      ]
+
+    self.outputs = self.bars + [
+        self.display,
+        self.integrity,
+        self.array,
+        self.maple,
+      ]
+
+    self.sounds = SoundPlayer(enabled = sound)
+
+    self.all = self.inputs + self.outputs
+
+    # the main loop runs peripherals at their own rates via the executive
+    self.executive = Executive()
+    for p in self.readers:
+      self.executive.add(p, 'input')
+    for p in self.outputs:
+      self.executive.add(p, 'output')
+
+    # alternatively, every physical bus can get its own I/O thread
+    self.buses = {
+        'uart': ([], self.bars + [self.integrity, self.array, self.maple]),
+        'spi': ([], [self.display]),
+        'audio': ([], [self.sounds]),
+      }
+    for bus in self.i2c_buses:
+      self.buses[i2c_bus_name(bus)] = (bus_readers[bus], [])
+    self.workers = []
+
+  def __str__(self):
+    return "<Board on %s>" % self.i2c
+
+  def add_output(self, peripheral, bus):
+    """adds an output which isn't one of our devices (say, a checkpoint)
+
+    bus names the worker it runs on when threaded; call before start_workers()"""
+    self.outputs.append(peripheral)
+    self.all.append(peripheral)
+    self.executive.add(peripheral, 'output')
+    self.buses.setdefault(bus, ([], []))[1].append(peripheral)
+
+  def read_all(self):
+    """communicates with every peripheral right now, regardless of its rate"""
+    for p in self.all:
+      p.communicate()
+
+  def read_inputs(self, now):
+    """reads any inputs which are due; call right before sending state"""
+    self.executive.run('input', now)
+
+  def hold_inputs(self):
+    """takes one snapshot of the expanders, across every bus
+
+    When workers read the buses, call this once per tick instead of
+    read_inputs(), so the tick sees every bus as of the same moment."""
+    for mcp in self.inputs:
+      if type(mcp) == MCP23017:
+        mcp.hold()
+
+  def bus_report(self):
+    """how busy each I2C bus is, and what's on it; to balance the expanders"""
+    lines = []
+    for bus in self.i2c_buses:
+      addresses = ", ".join("0x%02x" % mcp.address for mcp in self.inputs
+          if type(mcp) == MCP23017 and mcp.smbus is bus)
+      lines.append("%s (%s): %s" % (bus, addresses or "no expanders", bus.traffic))
+      lines.extend("  %s" % group for group in self.expanders if group.smbus is bus)
+
+    return "\n".join(lines)
+
+  def write_outputs(self, now):
+    """flushes any outputs which are due; call after applying instructions"""
+    self.executive.run('output', now)
+
+  def input_activity(self):
+    """did any input change on the last read (or, for expanders, hold)?"""
+    for p in self.inputs:
+      if type(p) == MCP23017:
+        if p.held_changed:
+          return True
+      elif getattr(p, 'changed', False):
+        return True
+
+    return False
+
+  def poll_only(self, used):
+    """reads only the expander pins in used, a dict of expander to pin mask
+
+    Expanders nothing uses aren't read at all, just checked on now and then;
+    see MCP23017Group. Call before reset_all(), so interrupts match."""
+    for mcp in self.inputs:
+      if type(mcp) == MCP23017:
+        mcp.poll_only(used.get(mcp, 0))
+
+    for group in self.expanders:
+      group.plan()
+
+  def start_workers(self, on_start = {}, rate = None):
+    """hands every peripheral over to the worker for its bus
+
+    on_start may map bus names to a function the worker calls in its thread
+    before it starts work. With rate (an AdaptiveRate), the workers which read
+    inputs slow down with it when nobody's playing. From now on, the main loop sees new inputs only
+    when it calls hold_inputs()."""
+    self.hold_inputs()
+
+    for bus, (inputs, outputs) in sorted(self.buses.items()):
+      worker = BusWorker(bus, inputs, outputs, on_start.get(bus), rate if inputs else None)
+      worker.start()
+      self.workers.append(worker)
+
+  def stop_workers(self):
+    while self.workers:
+      self.workers.pop().stop()
+
+  def toggle_reset(self):
+    if self.gpio is None:
+      print "GPIO is not available; can't toggle the reset line"
+      return
+
+    self.gpio.setup(RESET_PIN, self.gpio.OUT)
+    self.gpio.output(RESET_PIN, 0)
     time.sleep(0.1)
+    self.gpio.output(RESET_PIN, 1)
+
+  def reset_all(self, background = False):
+    """resets all peripherals
+
+    Devices on different buses come up concurrently (see boot.py). With
+    background, we don't wait for the display and the sounds, which are slow
+    to start and which no input needs."""
+    boot = BootGraph()
+    reset_line = boot.add("reset line", self.toggle_reset)
+
+    boot.add("display", self.display.start, after = [reset_line], wait = not background)
+    boot.add("maple", self.reset_maple, after = [reset_line])
+    mcps = boot.add("mcps", self.reset_mcps, after = [reset_line])
+    boot.add("adcs", self.reset_adcs, after = [mcps])
+    boot.add("sounds", self.sounds.reset, wait = not background)
+
+    # these just record what to show, whenever the devices are up
+    self.display.message = 'READY!'
+    self.sounds.set_music('ambient')
+
+    # the stage timings only matter when something's wrong, or we asked
     try:
-      MAPLE.get_state()
-    except:
-      tries += 1
-    else:
-      break
-
-  # re-initalize any mcp port expanders
-  mcps = [p for p in INPUTS if type(p) == MCP23017]
-  for mcp in mcps:
-    mcp.reset()
-
-  # reset any ADC devices
-  adcs = [p for p in INPUTS if type(p) == ADS1115]
-  if len(adcs) > 0:
-    all_call_reset(_SMBUS)
-
-    # send config to any devices
-    for adc in adcs:
-      adc.reset()
-
-  DISPLAY.message = 'READY!'
-  SOUNDS.set_music('ambient')
+      boot.run()
+    except Exception:
+      print boot
+      raise
+
+    if PROFILE.enabled:
+      print boot
+
+  def reset_maple(self):
+    self.maple.reset()
+    tries = 0
+    while tries < 5:
+      time.sleep(0.1)
+      try:
+        self.maple.get_state()
+      except:
+        tries += 1
+      else:
+        break
+
+  def reset_mcps(self):
+    """re-initalizes the port expanders; they share a bus, so one at a time"""
+    for mcp in self.inputs:
+      if type(mcp) == MCP23017:
+        mcp.reset()
+
+    self.watch_interrupts()
+
+  def watch_interrupts(self):
+    """starts watching the INT lines of expanders which use interrupts"""
+    for group in self.expanders:
+      if isinstance(group, MCP23017InterruptGroup):
+        group.watch()
+
+  def reset_adcs(self):
+    adcs = [p for p in self.inputs if type(p) == ADS1115]
+    if len(adcs) > 0:
+      all_call_reset(self.i2c)
+
+      # send config to any devices
+      for adc in adcs:
+        adc.reset()
+
+  def start_slow_outputs(self, background = False):
+    """starts the display and the sounds, in the background if asked"""
+    for name, start in [('display', self.display.start), ('sounds', self.sounds.reset)]:
+      if background:
+        in_background(name, start)
+      else:
+        with PROFILE.step("start %s" % name):
+          start()
+
+  def warm_reset(self, background = False):
+    """picks up devices left configured by a previous run, without resetting them
+
+    Returns False, having touched nothing, if any device doesn't answer the way
+    we left it; then only reset_all() will do."""
+    try:
+      self.maple.get_state()
+    except Exception, e:
+      print "%s isn't answering (%s); can't warm reset" % (self.maple, e)
+      return False
+
+    for mcp in self.inputs:
+      if type(mcp) == MCP23017 and not mcp.verify():
+        print "%s has lost its configuration; can't warm reset" % mcp
+        return False
+
+    self.watch_interrupts()
+
+    # the display and the music went away with the last run
+    self.start_slow_outputs(background)
+    self.sounds.set_music('ambient')
+    return True
+
+def i2c_bus_name(bus):
+  """the name of the worker for an I2C bus; see Board.buses"""
+  return "i2c-%d" % bus.bus_id
+
+def real_board(interrupt_pins = INTERRUPT_PINS, expander_buses = EXPANDER_BUSES):
+  """the board we're running on, talking to the actual hardware
+
+  expander_buses maps expander addresses to bus ids, for those not on BUS_ID"""
+  i2c = I2CBus(BUS_ID)
+  opened = {BUS_ID: i2c}
+  for bus_id in expander_buses.values():
+    if bus_id not in opened:
+      opened[bus_id] = I2CBus(bus_id)
+
+  return Board(i2c, SERIAL_PORT, gpio = setup_gpio(), interrupt_pins = interrupt_pins,
+      expander_buses = dict((address, opened[bus_id]) for address, bus_id in expander_buses.items()))
+
+def simulated_board(expander_buses = {}):
+  """a board of simulated devices; build as many as you like
+
+  expander_buses is as for real_board(), with a simulated bus for each id"""
+  from simulated import SimulatedI2CBus, SimulatedSerial
+  i2c = SimulatedI2CBus(BUS_ID)
+  opened = {BUS_ID: i2c}
+  for bus_id in expander_buses.values():
+    if bus_id not in opened:
+      opened[bus_id] = SimulatedI2CBus(bus_id)
+
+  return Board(i2c, SimulatedSerial(), sound = False,
+      expander_buses = dict((address, opened[bus_id]) for address, bus_id in expander_buses.items()))
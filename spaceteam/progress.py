@@ -7,6 +7,7 @@ FIRST_LED = 46
 
 class Progress(object):
   """Shows the remaining time..."""
+  RATE_HZ = 10
 
   def __init__(self, micro, led_count = LED_COUNT, first_led = FIRST_LED):
     self.micro = micro
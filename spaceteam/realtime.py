@@ -0,0 +1,83 @@
+#!/usr/bin/env python2.7
+"""Real-time scheduling for the input path
+
+The pi also runs logging and whatever else, and when those preempt us the
+switch-to-server latency suffers. This puts the calling thread on the
+SCHED_FIFO real-time class, pins it to one core and locks the process's memory
+so it never waits on a page fault. It works best when that core is also kept
+free of other work (isolcpus=3 on the kernel command line).
+
+All of this needs privileges (root, CAP_SYS_NICE/CAP_IPC_LOCK or a suitable
+RLIMIT_RTPRIO/RLIMIT_MEMLOCK); without them we explain what failed and carry
+on as a normal process.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import multiprocessing
+import os
+
+SCHED_FIFO = 1
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+DEFAULT_PRIORITY = 50
+
+class _SchedParam(ctypes.Structure):
+  _fields_ = [('sched_priority', ctypes.c_int)]
+
+def _libc():
+  return ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+
+def _error(what):
+  err = ctypes.get_errno()
+  hint = ""
+  if err == errno.EPERM:
+    hint = " (are we root, or do we have the right capabilities/rlimits?)"
+
+  return "%s failed: %s%s" % (what, os.strerror(err), hint)
+
+def default_cpu():
+  """the last core; the first ones tend to get the interrupts"""
+  return multiprocessing.cpu_count() - 1
+
+def enter(priority = DEFAULT_PRIORITY, cpu = None, lock_memory = True):
+  """makes the calling thread real-time; returns a list of what didn't work
+
+  Whatever fails is reported and skipped, so this never makes things worse
+  than running without it."""
+  problems = []
+  try:
+    libc = _libc()
+  except OSError, e:
+    problems.append("could not load libc: %s" % e)
+    return _report(problems)
+
+  # pid 0 means the calling thread, for both of these
+  param = _SchedParam(priority)
+  if libc.sched_setscheduler(0, SCHED_FIFO, ctypes.byref(param)) != 0:
+    problems.append(_error("SCHED_FIFO at priority %d" % priority))
+
+  if cpu is None:
+    cpu = default_cpu()
+  mask = ctypes.c_ulong(1 << cpu)
+  if libc.sched_setaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)) != 0:
+    problems.append(_error("pinning to cpu %d" % cpu))
+
+  if lock_memory and libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+    problems.append(_error("locking memory"))
+
+  return _report(problems, "SCHED_FIFO priority %d on cpu %d%s" % (
+    priority, cpu, ", memory locked" if lock_memory else ""))
+
+def _report(problems, summary = None):
+  if not problems:
+    print "Running real-time: %s" % summary
+  else:
+    print "Could not fully switch to real-time scheduling; continuing without:"
+    for problem in problems:
+      print "  %s" % problem
+
+  return problems
@@ -50,9 +50,10 @@ class SevenSegment(object):
 
 if __name__ == "__main__":
   import peripherals
-  peripherals.reset_all()
+  board = peripherals.real_board()
+  board.reset_all()
 
-  s1 = SevenSegment(peripherals.ARRAY, {
+  s1 = SevenSegment(board.array, {
     'dot': 4,
     'top': 31,
     'left_top': 29,
@@ -63,7 +64,7 @@ if __name__ == "__main__":
     'bottom': 14,
     })
 
-  s2 = SevenSegment(peripherals.ARRAY, {
+  s2 = SevenSegment(board.array, {
     'dot': 22,
     'top': 15,
     'left_top': 2,
@@ -74,7 +75,7 @@ if __name__ == "__main__":
     'bottom': 9,
     })
 
-  s3 = SevenSegment(peripherals.ARRAY, {
+  s3 = SevenSegment(board.array, {
     'dot': 12,
     'top': 10,
     'left_top': 24,
@@ -90,41 +91,41 @@ if __name__ == "__main__":
   s1.display('h')
   s2.display('e')
   s3.display('1')
-  peripherals.ARRAY.communicate()
+  board.array.communicate()
   time.sleep(5)
 
   s1.display('e')
   s2.display('1')
   s3.display('1')
-  peripherals.ARRAY.communicate()
+  board.array.communicate()
   time.sleep(5)
 
   s1.display('1')
   s2.display('1')
   s3.display('0')
-  peripherals.ARRAY.communicate()
+  board.array.communicate()
   time.sleep(5)
 
   s1.display('1')
   s2.display('0')
   s3.display('.')
-  peripherals.ARRAY.communicate()
+  board.array.communicate()
   time.sleep(5)
 
   s1.display('1')
   s2.display('0')
   s3.display('.')
-  peripherals.ARRAY.communicate()
+  board.array.communicate()
   time.sleep(5)
 
   s1.display('0')
   s2.display('.')
   s3.display('.')
-  peripherals.ARRAY.communicate()
+  board.array.communicate()
   time.sleep(5)
 
   s1.display('.')
   s2.display('.')
   s3.display('.')
-  peripherals.ARRAY.communicate()
+  board.array.communicate()
   print "moving on!"
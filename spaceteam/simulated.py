@@ -0,0 +1,160 @@
+#!/usr/bin/env python2.7
+"""Simulated stand-ins for the hardware the console talks to
+
+These let the console logic run (and be benchmarked) somewhere that has no
+pi attached; see peripherals.simulated_board().
+"""
+
+from cobs import cobs
+import struct
+
+import i2c
+
+class SimulatedI2CBus(object):
+  """Looks like an I2CBus (or smbus.SMBus), but every device is a register file
+
+  Each address gets 256 byte-wide registers, all zero to start with; reads and
+  writes auto-increment the register pointer like most devices do. Set
+  `registers[address][register]` to simulate an input changing."""
+  def __init__(self, bus_id = 1):
+    self.bus_id = bus_id
+    self.registers = {}
+    self.pointers = {}
+
+    self.traffic = i2c.BusTraffic()
+
+  def __str__(self):
+    return "<SimulatedI2CBus %d>" % self.bus_id
+
+  def close(self):
+    pass
+
+  @property
+  def transactions(self):
+    return self.traffic.transactions
+
+  def device(self, address):
+    """the register file for the device at address"""
+    if address not in self.registers:
+      self.registers[address] = [0] * 256
+      self.pointers[address] = 0
+
+    return self.registers[address]
+
+  def functionality(self):
+    return i2c.I2C_FUNC_I2C
+
+  def transfer(self, messages):
+    """performs the messages (see i2c.write_message and read_message)"""
+    self.traffic.record(len(messages), sum(msg.len for msg in messages))
+    for msg in messages:
+      if msg.flags & i2c.I2C_M_RD:
+        data = self._read(msg.addr, msg.len)
+        for idx, byte in enumerate(data):
+          msg.buf[idx] = byte
+      else:
+        self._write(msg.addr, i2c.message_bytes(msg))
+
+    return messages
+
+  def read_blocks(self, reads):
+    """like I2CBus.read_blocks, in a single transaction"""
+    self.traffic.record(2 * len(reads), sum(1 + length for _, _, length in reads))
+    replies = []
+    for address, register, length in reads:
+      self._write(address, [register])
+      replies.append(self._read(address, length))
+
+    return replies
+
+  def _write(self, address, data):
+    registers = self.device(address)
+    if not data:
+      return
+
+    # the first byte sets the pointer, anything after is written from there
+    pointer = data[0]
+    for byte in data[1:]:
+      registers[pointer] = byte
+      pointer = (pointer + 1) % 256
+    self.pointers[address] = data[0] if len(data) == 1 else pointer
+
+  def _read(self, address, length):
+    registers = self.device(address)
+    pointer = self.pointers[address]
+
+    data = [registers[(pointer + i) % 256] for i in xrange(length)]
+    self.pointers[address] = (pointer + length) % 256
+    return data
+
+  # the smbus.SMBus methods we use
+
+  def write_byte(self, address, value):
+    self.traffic.record(1, 1)
+    self._write(address, [value])
+
+  def write_byte_data(self, address, register, value):
+    self.traffic.record(1, 2)
+    self._write(address, [register, value])
+
+  def read_byte_data(self, address, register):
+    return self.read_i2c_block_data(address, register, 1)[0]
+
+  def write_word_data(self, address, register, value):
+    self.traffic.record(1, 3)
+    self._write(address, [register, value & 0xFF, (value >> 8) & 0xFF])
+
+  def read_word_data(self, address, register):
+    lsb, msb = self.read_i2c_block_data(address, register, 2)
+    return (msb << 8) | lsb
+
+  def write_i2c_block_data(self, address, register, data):
+    self.traffic.record(1, 1 + len(data))
+    self._write(address, [register] + list(data))
+
+  def read_i2c_block_data(self, address, register, length):
+    self.traffic.record(2, 1 + length)
+    self._write(address, [register])
+    return self._read(address, length)
+
+class SimulatedSerial(object):
+  """Looks like the serial.Serial the microcontroller is on
+
+  Commands written to it are decoded and counted by type in `commands`; state
+  requests ('G') are answered like the firmware would, with `throttle` as the
+  throttle reading."""
+  port = 'simulated'
+
+  def __init__(self, throttle = 0):
+    self.throttle = throttle
+    self.commands = {}
+
+    self._pending = ''
+    self._replies = bytearray()
+
+  def isOpen(self):
+    return True
+
+  def close(self):
+    pass
+
+  def write(self, data):
+    frames = (self._pending + data).split('\x00')
+    self._pending = frames.pop()
+
+    for frame in frames:
+      command = cobs.decode(frame)
+      if not command:
+        continue
+
+      self.commands[command[0]] = self.commands.get(command[0], 0) + 1
+      if command[0] == 'G':
+        received = sum(self.commands.values())
+        reply = 'S' + struct.pack('>IIH', received, 0, self.throttle)
+        self._replies += cobs.encode(reply) + '\x00'
+
+  def read(self, size = 1):
+    """the next size bytes of any replies; less if there aren't any (a timeout)"""
+    data = str(self._replies[:size])
+    del self._replies[:size]
+    return data
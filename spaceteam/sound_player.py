@@ -1,22 +1,31 @@
 #!/usr/bin/env python
 """Functionality to play sounds in response to events"""
 
+from collections import deque
 import glob
-import pygame as pg
 import os
+import threading
 import time
 
-class SoundPlayer(object):
-  def __init__(self):
-    # init the mixer
-    pg.mixer.init(
-        frequency = 48000,
-        size = -16,
-        channels = 2,
-        buffer = 4096,
-      )
-    pg.init()
-    pg.mixer.set_num_channels(20)
+# pygame takes a while to import, so we only do it when the mixer starts;
+# without it (e.g. under pypy) we carry on, silently
+pg = None
+
+import clock
+from dirty import Dirtyable
+
+class SoundPlayer(Dirtyable):
+  # when buffered, how often we start queued sounds
+  RATE_HZ = 50
+
+  def __init__(self, enabled = True):
+    # we play nothing until reset() has started the mixer
+    self.wanted = enabled
+    self.enabled = False
+
+    # the music we should be playing, as (name, volume)
+    self.music = None
+    self._music_lock = threading.Lock()
 
     # find the sounds we have saved
     src_dir = os.path.dirname(__file__)
@@ -27,9 +36,57 @@ class SoundPlayer(object):
     # thread management
     self.channels = []
 
+    # when buffered, sounds wait here until the next communicate()
+    self.queue = None
+
+  def __str__(self):
+    return "<SoundPlayer with %d sounds>" % len(self.sounds)
+
   def reset(self):
-    "nothing to do here"
-    pass
+    """starts the mixer; this is slow, so it may be done on another thread
+
+    Sounds played before then are dropped, but the music starts once we're up."""
+    global pg
+    if not self.wanted or self.enabled:
+      return
+
+    if pg is None:
+      try:
+        import pygame as pg
+      except ImportError:
+        print "pygame is not available; sounds are disabled"
+        return
+
+    pg.mixer.init(
+        frequency = 48000,
+        size = -16,
+        channels = 2,
+        buffer = 4096,
+      )
+    pg.init()
+    pg.mixer.set_num_channels(20)
+
+    with self._music_lock:
+      self.enabled = True
+      if self.music is not None:
+        self._start_music(*self.music)
+
+  def buffer_commands(self):
+    """queue sounds instead of playing them; communicate() plays them"""
+    if self.queue is None:
+      self.queue = deque()
+
+  def communicate(self):
+    """starts any queued sounds"""
+    while self.queue:
+      func, args = self.queue.popleft()
+      func(*args)
+
+    self.clean_up_channels()
+
+    # keep cleaning up until every sound has finished
+    if self.channels:
+      self.wake_at(clock.CLOCK.now() + 1)
 
   def stop(self):
     while len(self.channels) > 0:
@@ -37,6 +94,16 @@ class SoundPlayer(object):
       self.clean_up_channels()
 
   def play(self, name, volume = 1.2):
+    if self.queue is not None:
+      self.queue.append((self._play, (name, volume)))
+      self.mark_dirty()
+    else:
+      self._play(name, volume)
+
+  def _play(self, name, volume):
+    if not self.enabled:
+      return
+
     sound = pg.mixer.Sound(self.sounds[name])
     if volume:
       sound.set_volume(volume)
@@ -50,6 +117,19 @@ class SoundPlayer(object):
         self.channels.remove(channel)
 
   def set_music(self, name, volume = 1.2):
+    if self.queue is not None:
+      self.queue.append((self._set_music, (name, volume)))
+      self.mark_dirty()
+    else:
+      self._set_music(name, volume)
+
+  def _set_music(self, name, volume):
+    with self._music_lock:
+      self.music = (name, volume)
+      if self.enabled:
+        self._start_music(name, volume)
+
+  def _start_music(self, name, volume):
     if name is None:
       pg.mixer.music.fadeout(1)
     else:
@@ -60,5 +140,6 @@ class SoundPlayer(object):
 
 if __name__ == "__main__":
   p = SoundPlayer()
+  p.reset()
   p.play('space')
   p.stop()
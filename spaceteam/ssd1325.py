@@ -1,6 +1,3 @@
-from luma.core.interface.serial import spi
-from luma.oled.device import ssd1325
-
 from utils import *
 
 from display import Display
@@ -11,19 +8,35 @@ class SSD1325(Display):
   def __init__(self, gpio, gpio_DC, gpio_RST, port = 0, device = 0):
     Display.__init__(self)
 
+    self.gpio = gpio
+    self.gpio_DC = gpio_DC
+    self.gpio_RST = gpio_RST
     self.port = port
-    self.device = device
-    self.spi = spi(
-        gpio = gpio,
-        port = self.port,
-        device = self.device,
-        gpio_DC = gpio_DC,
-        gpio_RST = gpio_RST)
+    self.spi_device = device
 
-    self.device = self.get_device()
+    # luma is slow to import, so we wait until we start to set up spi
+    self.spi = None
 
   def __str__(self):
-    return "<SSD1323 at SPI{:x}:{:x}>".format(self.port, self.device)
+    return "<SSD1323 at SPI{:x}:{:x}>".format(self.port, self.spi_device)
 
   def get_device(self):
+    try:
+      from luma.core.interface.serial import spi
+      from luma.oled.device import ssd1325
+    except ImportError:
+      spi = None
+
+    if spi is None or self.gpio is None:
+      print "luma or GPIO is not available; %s is disabled" % self
+      return None
+
+    if self.spi is None:
+      self.spi = spi(
+          gpio = self.gpio,
+          port = self.port,
+          device = self.spi_device,
+          gpio_DC = self.gpio_DC,
+          gpio_RST = self.gpio_RST)
+
     return ssd1325(self.spi)
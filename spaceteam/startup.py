@@ -0,0 +1,109 @@
+#!/usr/bin/env python2.7
+"""Keeping startup fast, and finding out where it isn't
+
+Slow things which the input path doesn't need (loading luma for the display,
+pygame for the sounds) start in the background, so we can tell systemd we're
+ready as soon as the controls work. With --profile-startup, PROFILE times
+every import and every startup step, and report() says where the time went.
+"""
+
+from contextlib import contextmanager
+import __builtin__
+import sys
+import threading
+import time
+import traceback
+
+# imports quicker than this aren't worth reporting
+MIN_REPORTED_SEC = 0.005
+
+class StartupProfile(object):
+  """Times imports and named startup steps, once start() is called"""
+  def __init__(self):
+    self.enabled = False
+    self.started = None
+
+    # (start, thread, depth, name, seconds) for every import which loaded something
+    self.imports = []
+    # (thread, name, seconds) for every step
+    self.steps = []
+
+    self._import = None
+    self._local = threading.local()
+
+  def start(self):
+    """starts timing; call as early as possible"""
+    if self.enabled:
+      return
+
+    self.enabled = True
+    self.started = time.time()
+    self._import = __builtin__.__import__
+    __builtin__.__import__ = self._timed_import
+
+  def stop(self):
+    if self._import is not None:
+      __builtin__.__import__ = self._import
+      self._import = None
+
+  def _timed_import(self, name, *args, **kwargs):
+    depth = getattr(self._local, 'depth', 0)
+    self._local.depth = depth + 1
+
+    loaded = len(sys.modules)
+    started = time.time()
+    try:
+      return self._import(name, *args, **kwargs)
+    finally:
+      self._local.depth = depth
+      if len(sys.modules) > loaded:
+        self.imports.append(
+            (started, threading.current_thread().name, depth, name, time.time() - started))
+
+  @contextmanager
+  def step(self, name):
+    """times the body of the with statement as the named step"""
+    started = time.time()
+    try:
+      yield
+    finally:
+      if self.enabled:
+        elapsed = time.time() - started
+        self.steps.append((threading.current_thread().name, name, elapsed))
+
+  def report(self):
+    """prints where the time went so far"""
+    if not self.enabled:
+      return
+
+    print "Startup: %.3fs so far" % (time.time() - self.started)
+    print "  imports:"
+    # in the order they started, so nested imports come after their parent
+    for _, thread, depth, name, elapsed in sorted(self.imports):
+      if elapsed >= MIN_REPORTED_SEC:
+        print "    %7.3fs %s%s (%s)" % (elapsed, '  ' * depth, name, thread)
+
+    print "  steps:"
+    for thread, name, elapsed in self.steps:
+      print "    %7.3fs %s (%s)" % (elapsed, name, thread)
+
+PROFILE = StartupProfile()
+
+def in_background(name, func):
+  """runs func on its own thread, as a startup step; returns the thread"""
+  def run():
+    try:
+      with PROFILE.step(name):
+        func()
+    except Exception, e:
+      print "Starting %s failed: %s" % (name, e)
+      traceback.print_exc()
+    else:
+      if PROFILE.enabled:
+        print "Started %s in the background, %.3fs into startup" % (
+            name, time.time() - PROFILE.started)
+
+  thread = threading.Thread(target = run, name = "start-%s" % name)
+  thread.daemon = True
+  thread.start()
+  return thread
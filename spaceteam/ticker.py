@@ -0,0 +1,174 @@
+#!/usr/bin/env python2.7
+"""A fixed-rate tick scheduler for the main loop
+
+Instead of spinning as fast as possible, the loop asks the ticker to wait for
+the next tick. Deadlines are absolute, so time spent doing I/O during a tick is
+subtracted from the following sleep rather than added to the period. Every
+tick also ticks the shared clock, so the rest of the tick sees one time.
+"""
+
+import math
+
+import clock
+
+DEFAULT_RATE_HZ = 200
+DEFAULT_IDLE_RATE_HZ = 50
+
+class Ticker(object):
+  """Sleeps until evenly-spaced deadlines and keeps track of overruns
+
+    Passed values:
+      rate_hz: how many ticks per second we are aiming for
+
+    A tick overruns when the work done during it takes longer than a period;
+    in that case we don't try to catch up with a burst of short ticks, we just
+    schedule the next deadline one period from now.
+  """
+  def __init__(self, rate_hz = DEFAULT_RATE_HZ):
+    if rate_hz <= 0:
+      raise ValueError("Tick rate must be positive (got %s)" % rate_hz)
+
+    self.rate_hz = rate_hz
+    self.period = 1.0 / rate_hz
+
+    self.ticks = 0
+    self.overruns = 0
+    self.worst_overrun = 0
+
+    # how late we actually woke up, on ticks where we slept
+    self.woken = 0
+    self.total_jitter = 0
+    self.worst_jitter = 0
+
+    self.started = None
+    self.deadline = None
+    self.last_tick = None
+
+  def start(self):
+    """begins counting ticks from now"""
+    self.started = clock.CLOCK.read()
+    self.last_tick = self.started
+    self.deadline = self.started + self.period
+
+  def set_rate(self, rate_hz):
+    """changes the rate from the next tick on"""
+    if rate_hz <= 0:
+      raise ValueError("Tick rate must be positive (got %s)" % rate_hz)
+
+    self.rate_hz = rate_hz
+    self.period = 1.0 / rate_hz
+
+    # speeding up shouldn't have to wait out the rest of a long period
+    if self.deadline is not None:
+      self.deadline = min(self.deadline, self.last_tick + self.period)
+
+  def wait(self, until = None):
+    """sleeps until the next tick is due; returns the time it is now
+
+    If until is given and comes before the next tick, we only sleep until
+    then; this lets the loop wake up for things like animation deadlines
+    without counting it as a tick."""
+    if self.deadline is None:
+      self.start()
+
+    now = clock.CLOCK.read()
+    if until is not None and until < self.deadline:
+      if until > now:
+        clock.CLOCK.sleep(until - now)
+        now = until
+      return clock.CLOCK.tick(now)
+
+    remaining = self.deadline - now
+
+    if remaining > self.period:
+      # the clock jumped backwards (or was swapped); don't sleep for ages
+      self.deadline = now + self.period
+      remaining = self.period
+
+    if remaining > 0:
+      clock.CLOCK.sleep(remaining)
+      self._note_jitter(clock.CLOCK.read() - self.deadline)
+
+      now = self.deadline
+      self.deadline += self.period
+
+    else:
+      # we missed our deadline; note it, and start afresh from now
+      self.overruns += 1
+      self.worst_overrun = max(self.worst_overrun, -remaining)
+      self.deadline = now + self.period
+
+    self.ticks += 1
+    self.last_tick = now
+    return clock.CLOCK.tick(now)
+
+  def _note_jitter(self, jitter):
+    self.woken += 1
+    self.total_jitter += jitter
+    self.worst_jitter = max(self.worst_jitter, jitter)
+
+  def slack(self):
+    """how long until the next tick is due"""
+    if self.deadline is None:
+      return self.period
+
+    return self.deadline - clock.CLOCK.read()
+
+  def stats(self):
+    """a summary of how well we've been keeping up"""
+    elapsed = (clock.CLOCK.read() - self.started) if self.started is not None else 0
+    return {
+        'ticks': self.ticks,
+        'overruns': self.overruns,
+        'worst_overrun_ms': self.worst_overrun * 1000,
+        'mean_jitter_ms': (self.total_jitter / self.woken * 1000) if self.woken else 0,
+        'worst_jitter_ms': self.worst_jitter * 1000,
+        'actual_rate_hz': (self.ticks / elapsed) if elapsed > 0 else 0,
+      }
+
+  def __str__(self):
+    stats = self.stats()
+    return "<Ticker at %dHz: %d ticks (%.1fHz actual), %d overruns (worst %.1fms), jitter %.2fms (worst %.2fms)>" % (
+        self.rate_hz,
+        stats['ticks'],
+        stats['actual_rate_hz'],
+        stats['overruns'],
+        stats['worst_overrun_ms'],
+        stats['mean_jitter_ms'],
+        stats['worst_jitter_ms'])
+
+class AdaptiveRate(object):
+  """A tick rate which speeds up with activity and slows down when idle
+
+    Passed values:
+      idle_hz: the rate we settle at when nothing is happening
+      active_hz: the rate we jump to as soon as something happens
+      hold_sec: how long we stay at the active rate after the last activity
+      decay_sec: time constant of the exponential slide back towards idle_hz
+  """
+  def __init__(self, idle_hz = DEFAULT_IDLE_RATE_HZ, active_hz = DEFAULT_RATE_HZ,
+      hold_sec = 2, decay_sec = 5):
+    if idle_hz <= 0 or active_hz < idle_hz:
+      raise ValueError("Need 0 < idle_hz <= active_hz (got %s and %s)" % (idle_hz, active_hz))
+
+    self.idle_hz = idle_hz
+    self.active_hz = active_hz
+    self.hold_sec = hold_sec
+    self.decay_sec = decay_sec
+
+    self.last_activity = None
+
+  def note_activity(self, now):
+    self.last_activity = now
+
+  def rate(self, now):
+    """the rate we should be running at, at time now"""
+    if self.last_activity is None:
+      return self.idle_hz
+
+    quiet = now - self.last_activity - self.hold_sec
+    if quiet <= 0:
+      return self.active_hz
+
+    boost = (self.active_hz - self.idle_hz) * math.exp(-quiet / self.decay_sec)
+    return self.idle_hz + boost
@@ -0,0 +1,93 @@
+#!/usr/bin/env python2.7
+"""One I/O thread per physical bus
+
+Each worker owns the peripherals on its bus and is the only thread that talks
+to them. Workers publish what they read by swapping in fresh snapshots (like
+MCP23017.input_bits or Microcontroller.state) and consume commands which
+other threads leave in deques (see `buffer_commands()` on the microcontroller
+and the sound player). Neither side ever waits on a lock held by the other,
+so the game loop only touches in-memory state and a slow bus can only slow
+itself down.
+"""
+
+import threading
+import traceback
+
+from executive import Executive
+from ticker import Ticker
+
+class BusWorker(threading.Thread):
+  """Runs the peripherals on one bus at their declared rates
+
+    Passed values:
+      bus: the name of the bus, for messages
+      inputs: peripherals we read from; run first on every tick
+      outputs: peripherals we write to; run after the inputs
+      on_start: called from the worker thread before it starts ticking
+      rate: an AdaptiveRate to slow down to when nobody is playing (see
+        spaceteam.py's --adaptive); we never tick faster than our peripherals
+        want, and any input changing counts as activity
+  """
+  def __init__(self, bus, inputs = [], outputs = [], on_start = None, rate = None):
+    threading.Thread.__init__(self, name = "%s-worker" % bus)
+    self.daemon = True
+
+    self.bus = bus
+    self.inputs = inputs
+    self.on_start = on_start
+    self.rate = rate
+    self.executive = Executive()
+    for p in inputs:
+      self.executive.add(p, 'input')
+    for p in outputs:
+      self.executive.add(p, 'output')
+
+    # tick as fast as our fastest peripheral wants to run
+    tasks = inputs + outputs
+    self.max_rate_hz = max(t.rate_hz for ts in self.executive.tasks.values() for t in ts)
+    self.ticker = Ticker(self.max_rate_hz)
+
+    self.error = None
+    self._stop_event = threading.Event()
+
+    # anything we own which can take commands from other threads must buffer them
+    for p in tasks:
+      if hasattr(p, 'buffer_commands'):
+        p.buffer_commands()
+
+  def __str__(self):
+    return "<BusWorker for %s>" % self.bus
+
+  def run(self):
+    try:
+      if self.on_start:
+        self.on_start()
+
+      self.ticker.start()
+      while not self._stop_event.isSet():
+        now = self.ticker.wait()
+        self.executive.run_all(now)
+
+        if self.rate:
+          self._adapt(now)
+
+    except Exception, e:
+      self.error = e
+      print "%s stopped on error: %s" % (self, e)
+      traceback.print_exc()
+
+  def _adapt(self, now):
+    for p in self.inputs:
+      if getattr(p, 'changed', False):
+        self.rate.note_activity(now)
+        break
+
+    self.ticker.set_rate(min(self.max_rate_hz, self.rate.rate(now)))
+
+  def stop(self):
+    self._stop_event.set()
+    if self.is_alive():
+      self.join()
+
+  def running(self):
+    return self.is_alive() and self.error is None